@@ -0,0 +1,250 @@
+import io, os, sys, json, time, zlib, random, struct, shutil, tarfile, zipfile, argparse, builtins, tempfile, threading, contextlib, subprocess, http.server
+from urllib.parse import unquote
+try: import resource
+except ImportError: resource = None  # Peak RSS is not reported where resource is unavailable
+
+# Offline benchmarks: a local mirror stand-in serves synthetic listings and archives, and every command runs in its own
+# child process (HOME pointed at a scratch directory) so timings and peak RSS are not polluted by earlier commands.
+
+COMMANDS = ["update", "update-cached", "search", "install", "compress", "autoremove", "autoremove-content"]
+WORDS = ["super", "mario", "zelda", "legend", "sonic", "metroid", "kart", "world", "quest", "dragon", "fantasy", "street", "fighter", "mega", "man", "castle", "racing", "soccer", "tennis", "star", "wars", "adventure", "island", "puzzle", "tetris", "pinball", "golf", "ninja", "turtles", "contra"]
+TAGS = ["(USA)", "(Europe)", "(Japan)", "(World)", "(USA, Europe)", "(Japan) (Rev 1)", "(Europe) (En,Fr,De)", "(USA) (Beta)", "(USA) (Proto)", "(Japan) (Disc 1)"]
+QUERIES = [["mario"], ["zelda", "-beta"], ["legend", "of"], ["super", "sys1"], ["all", "sys0"], ["dragon", "quest", "-proto", "-beta"]]
+
+def game_names(count, seed=0):  # Deterministic No-Intro style names with region/revision tags
+    rng = random.Random(seed)
+    return [f"{' '.join(w.title() for w in rng.sample(WORDS, rng.randint(1, 4)))} {i} {rng.choice(TAGS)}" for i in range(count)]
+
+def size_str(n):  # Size column text in the mirror's format
+    for u in ("B", "K", "M", "G"):
+        if n < 1024: return f"{n:.1f}{u}"
+        n /= 1024
+    return f"{n:.1f}T"
+
+def listing_page(entries):  # Directory listing page in the table layout the listing parser expects
+    rows = "".join(f'<tr><td><a href="{name.replace(" ", "%20")}">{name}</a></td><td>01-Jan-2024 00:00</td><td>{size_str(size)}</td></tr>' for name, size in entries)
+    return (f'<html><body><table class="directory-listing-table"><thead><tr><th>Name</th><th>Last modified</th><th>Size</th></tr></thead>'
+            f'<tbody><tr><td><a href="../">Parent directory</a></td><td></td><td>-</td></tr>{rows}</tbody></table></body></html>').encode()
+
+def rar_block(htype, flags, body, data=b""):  # RAR4 block with its header CRC
+    head = struct.pack("<BHH", htype, flags, 7 + len(body)) + body
+    return struct.pack("<H", zlib.crc32(head) & 0xFFFF) + head + data
+
+def rar_stored(members):  # Minimal RAR4 archive with stored (method 0x30) members, readable without unrar
+    out = [b"Rar!\x1a\x07\x00", rar_block(0x73, 0, b"\0" * 6)]
+    for name, data in members:
+        n = name.encode()
+        out.append(rar_block(0x74, 0x8000, struct.pack("<IIBIIBBHI", len(data), len(data), 0, zlib.crc32(data), 0x21 << 16, 20, 0x30, len(n), 0x20) + n, data))
+    out.append(rar_block(0x7B, 0x4000, b""))
+    return b"".join(out)
+
+def payload(name, fmt, data):  # Archive holding one ROM member
+    buf = io.BytesIO()
+    if fmt == "zip":
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z: z.writestr(name, data)
+    elif fmt == "tar.xz":
+        with tarfile.open(fileobj=buf, mode="w:xz") as t:
+            info = tarfile.TarInfo(name); info.size = len(data); t.addfile(info, io.BytesIO(data))
+    elif fmt == "7z":
+        import py7zr
+        with py7zr.SevenZipFile(buf, "w") as z: z.writestr(data, name)
+    else: return rar_stored([(name, data)])
+    return buf.getvalue()
+
+def rom_data(size, seed):  # Partly compressible ROM-like bytes
+    rng = random.Random(seed)
+    block = rng.randbytes(4096) if hasattr(rng, "randbytes") else bytes(rng.getrandbits(8) for _ in range(4096))
+    return (block + bytes(4096)) * (size // 8192) + block[:size % 8192]
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):  # Listings and payloads with Range, ETag, latency and bandwidth
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args): pass
+
+    def do_HEAD(self): self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        time.sleep(self.server.latency)
+        path = unquote(self.path.split("?")[0])
+        body = self.server.pages.get(path)
+        if body is None: self.send_response(404); self.send_header("Content-Length", "0"); self.end_headers(); return
+        etag = f'"{zlib.crc32(body):08x}"'
+        if self.headers.get("If-None-Match") == etag: self.send_response(304); self.send_header("ETag", etag); self.send_header("Content-Length", "0"); self.end_headers(); return
+        start, end, rng = 0, len(body) - 1, self.headers.get("Range", "")
+        if rng.startswith("bytes="):
+            a, _, b = rng[6:].split(",")[0].partition("-")
+            if a: start, end = int(a), min(int(b), end) if b else end
+            else: start = max(0, len(body) - int(b))
+            if start > end:
+                self.send_response(416); self.send_header("Content-Range", f"bytes */{len(body)}"); self.send_header("Content-Length", "0"); self.end_headers(); return
+            self.send_response(206); self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        else: self.send_response(200)
+        self.send_header("Content-Type", "text/html" if path.endswith("/") else "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1)); self.send_header("Accept-Ranges", "bytes"); self.send_header("ETag", etag)
+        self.end_headers()
+        if head: return
+        chunk = max(16384, int(self.server.bandwidth / 20)) if self.server.bandwidth else 1024**2
+        for i in range(start, end + 1, chunk):
+            data = body[i:min(i + chunk, end + 1)]
+            try: self.wfile.write(data)
+            except OSError: return
+            if self.server.bandwidth: time.sleep(len(data) / self.server.bandwidth)
+
+def start_mirror(pages, latency=0.0, bandwidth=0):  # Serve pages on an ephemeral localhost port
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+    server.pages, server.latency, server.bandwidth, server.daemon_threads = pages, latency, bandwidth, True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_mirror(args):  # Synthetic listings for args.systems systems plus a "bench" system with real payloads
+    pages, systems = {}, {}
+    for s in range(args.systems):
+        names = game_names(args.files, seed=s)
+        pages[f"/sys{s}/"] = listing_page([(n + ".zip", 1024 * (1 + i % 4096)) for i, n in enumerate(names)])
+        systems[f"sys{s}"] = {"name": f"System {s}", "format": ["bin"], "url": [f"/sys{s}/"]}
+    entries = []
+    for i, fmt in enumerate(f for f in args.formats for _ in range(args.payloads)):
+        name = f"Payload {fmt.replace('.', ' ')} {i} (USA)"
+        data = payload(name + ".bin", fmt, rom_data(args.payload_kb * 1024, i))
+        pages[f"/bench/{name}.{fmt}"] = data
+        entries.append((f"{name}.{fmt}", len(data)))
+    pages["/bench/"] = listing_page(entries)
+    systems["bench"] = {"name": "Benchmark payloads", "format": ["bin"], "url": ["/bench/"]}
+    return pages, systems, sum(len(pages[f"/bench/{n}"]) for n, _ in entries)
+
+def make_library(roms_dir, count, images=False):  # Synthetic ROM library with name duplicates, identical copies and disc images
+    shutil.rmtree(roms_dir, ignore_errors=True)
+    size = 0
+    for system in ("nes", "snes", "gb"): os.makedirs(os.path.join(roms_dir, system))
+    titles = [n.split(" (")[0] for n in game_names(count // 3 + 1, seed=99)]
+    for i in range(count):  # Each title appears three times with different tags and identical contents
+        data = rom_data(4096 + (i // 3 % 7) * 1024, i // 3)
+        path = os.path.join(roms_dir, ("nes", "snes", "gb")[i % 3], f"{titles[i // 3]} {TAGS[i % len(TAGS)]}.bin")
+        with open(path, "wb") as f: f.write(data)
+        size += len(data)
+    if images:
+        os.makedirs(os.path.join(roms_dir, "psx"))
+        for i in range(count // 10 or 1):
+            base = os.path.join(roms_dir, "psx", f"Disc {i} (USA)")
+            with open(base + (".iso" if i % 2 else ".bin"), "wb") as f: f.write(rom_data(256 * 1024, i))
+            if not i % 2:
+                with open(base + ".cue", "w") as f: f.write(f'FILE "Disc {i} (USA).bin" BINARY\n  TRACK 01 MODE2/2352\n    INDEX 01 00:00:00\n')
+            size += 256 * 1024
+    return size
+
+def stub_chdman(bin_dir):  # chdman stand-in on PATH that copies the input image to the output
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "chdman")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\nimport sys, shutil\na = sys.argv\nshutil.copyfile(a[a.index('-i') + 1], a[a.index('-o') + 1])\n")
+    os.chmod(path, 0o755)
+
+def run_command(cmd, spec):  # Run one command repeatedly in this process, returning per-iteration (seconds, units)
+    from .main import Manager, Converter, RomCleaner
+    roms, runs = spec["roms_dir"], []
+    builtins.input = lambda prompt="": "y"
+
+    def timed(fn, units):
+        t = time.perf_counter(); fn(); runs.append((time.perf_counter() - t, units))
+
+    if cmd in ("update", "update-cached"):
+        if cmd == "update-cached": Manager().update()
+        for _ in range(spec["repeat"]): timed(lambda: Manager().update(full=cmd == "update"), spec["entries"])
+    elif cmd == "search":
+        mgr = Manager(); mgr.update(); mgr.load()
+        for _ in range(spec["repeat"]):
+            for terms in QUERIES: timed(lambda: mgr.search(terms), 1)
+    elif cmd == "install":
+        mgr = Manager(); mgr.update()
+        for _ in range(spec["repeat"]):
+            shutil.rmtree(os.path.join(roms, "bench"), ignore_errors=True)
+            mgr = Manager(); mgr.load()
+            pkgs = mgr.search_for_install(["all", "bench"])
+            timed(lambda: mgr.install(pkgs), spec["payload_bytes"])
+    else:
+        for _ in range(spec["repeat"]):
+            size = make_library(roms, spec["library"], images=cmd == "compress")
+            if cmd == "compress": timed(lambda: Converter().auto_compress_all(), size)
+            else: timed(lambda: RomCleaner().clean(content=cmd == "autoremove-content"), spec["library"])
+    return runs
+
+def child(cmd, spec_path, out_path):  # Child process entry: run a command and write timings plus peak RSS
+    with open(spec_path) as f: spec = json.load(f)
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null): runs = run_command(cmd, spec)
+    rss = None
+    try:  # VmHWM starts over at exec; ru_maxrss can carry the forking parent's high-water mark
+        with open("/proc/self/status") as f: rss = next(int(l.split()[1]) * 1024 for l in f if l.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        if resource:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss = rss if sys.platform == "darwin" else rss * 1024  # ru_maxrss is KiB on Linux, bytes on macOS
+    with open(out_path, "w") as f: json.dump({"runs": runs, "rss": rss}, f)
+
+def percentile(values, p):  # Nearest-rank percentile
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+UNITS = {"update": "entries", "update-cached": "entries", "search": "queries", "install": "bytes", "compress": "bytes", "autoremove": "files", "autoremove-content": "files"}
+
+def rate(units, seconds, unit):  # Human readable throughput
+    if not seconds: return "-"
+    if unit == "bytes": return f"{units / seconds / 1024**2:.1f}MB/s"
+    return f"{units / seconds:,.0f} {unit}/s"
+
+def bench(argv=None):  # Run benchmarks and print a report
+    ap = argparse.ArgumentParser(prog="retro bench", description="Benchmark retro commands against a local mirror stand-in")
+    ap.add_argument("commands", nargs="*", metavar="command", help=f"commands to run (default: all of {', '.join(COMMANDS)})")
+    ap.add_argument("--systems", type=int, default=20, help="synthetic systems in the catalog")
+    ap.add_argument("--files", type=int, default=2000, help="listing entries per system")
+    ap.add_argument("--formats", default="zip,7z,tar.xz,rar", help="payload archive formats")
+    ap.add_argument("--payloads", type=int, default=4, help="payload archives per format")
+    ap.add_argument("--payload-kb", type=int, default=2048, help="uncompressed size of each payload ROM")
+    ap.add_argument("--library", type=int, default=3000, help="ROM files for compress/autoremove")
+    ap.add_argument("--latency", type=float, default=20, help="added latency per request in milliseconds")
+    ap.add_argument("--bandwidth", type=float, default=0, help="per-connection bandwidth in MB/s (0 = unlimited)")
+    ap.add_argument("--repeat", type=int, default=3, help="iterations per command")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args(argv)
+    unknown = [c for c in args.commands if c not in COMMANDS]
+    if unknown: ap.error(f"unknown command: {', '.join(unknown)}")
+    args.formats = [f for f in args.formats.split(",") if f]
+
+    pages, systems, payload_bytes = build_mirror(args)
+    server = start_mirror(pages, args.latency / 1000, int(args.bandwidth * 1024**2))
+    url = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+    print(f"Mirror: {url} ({args.systems} systems x {args.files} entries, {len(pages) - args.systems - 1} payloads, {args.latency:g}ms latency)")
+    print(f"{'command':<20}{'runs':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'throughput':>18}{'peak RSS':>12}")
+    try:
+        for cmd in args.commands or COMMANDS:
+            with tempfile.TemporaryDirectory(prefix="retro-bench-") as home:
+                config = os.path.join(home, ".config", "retro")
+                os.makedirs(config)
+                with open(os.path.join(config, "systems.json"), "w") as f:
+                    json.dump({k: {**v, "url": [url + u for u in v["url"]]} for k, v in systems.items()}, f)
+                roms = os.path.join(home, "roms")
+                with open(os.path.join(config, "settings.json"), "w") as f: json.dump({"roms_dir": roms, "verify_downloads": False}, f)
+                spec = {"roms_dir": roms, "repeat": args.repeat, "entries": args.systems * args.files + len(pages) - args.systems - 1, "payload_bytes": payload_bytes, "library": args.library}
+                with open(os.path.join(home, "spec.json"), "w") as f: json.dump(spec, f)
+                stub_chdman(os.path.join(home, "bin"))
+                env = {**os.environ, "HOME": home, "PATH": os.path.join(home, "bin") + os.pathsep + os.environ.get("PATH", ""), "NO_PROXY": "127.0.0.1", "no_proxy": "127.0.0.1"}
+                out = os.path.join(home, "result.json")
+                code = subprocess.call([sys.executable, "-m", "retro.bench", "--child", cmd, os.path.join(home, "spec.json"), out], env=env,
+                                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+                if code or not os.path.exists(out): print(f"{cmd:<20}  failed (exit {code})"); continue
+                with open(out) as f: result = json.load(f)
+            times = [t for t, _ in result["runs"]]
+            total_units, total_time = sum(u for _, u in result["runs"]), sum(times)
+            results[cmd] = {"runs": len(times), "p50": percentile(times, 50), "p95": percentile(times, 95), "p99": percentile(times, 99),
+                            "throughput": total_units / total_time if total_time else None, "unit": UNITS[cmd] + "/s", "peak_rss": result["rss"]}
+            rss = f"{result['rss'] / 1024**2:.1f}MB" if result["rss"] else "-"
+            r = results[cmd]
+            print(f"{cmd:<20}{r['runs']:>5}{r['p50']:>9.3f}s{r['p95']:>9.3f}s{r['p99']:>9.3f}s{rate(total_units, total_time, UNITS[cmd]):>18}{rss:>12}")
+    finally: server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f: json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]: child(*sys.argv[2:5])
+    else: bench(sys.argv[1:])
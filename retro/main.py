@@ -1,8 +1,11 @@
-import os, re, json, shutil, subprocess, requests, zipfile, tarfile, py7zr, rarfile
+import io, os, re, json, time, zlib, queue, atexit, codecs, struct, hashlib, shutil, sqlite3, threading
 from glob import glob
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+from html.parser import HTMLParser
+from urllib.parse import quote, urljoin, urlsplit
+# Heavier modules (requests, tqdm, asyncio, archive libraries, concurrent.futures, ...) are imported by the code paths that use them
 
 def get_config_dir():  # Get configuration directory path
     config_dir = os.path.expanduser("~/.config/retro")
@@ -16,8 +19,32 @@ def load_settings():  # Load settings from config file
         "roms_dir": os.path.expanduser("~/roms"),
         "fetch_workers": 10,
         "install_workers": 20,
-        "convert_workers": 4,
-        "compress_workers": 4
+        "convert_workers": 0,
+        "compress_workers": 0,
+        "host_connections": 8,
+        "http_retries": 3,
+        "http_backoff": 0.5,
+        "http_timeout": 60,
+        "segment_threshold_mb": 256,
+        "segments": 4,
+        "stream_extract": True,
+        "extract_workers": 4,
+        "extract_processes": False,
+        "extract_queue": 8,
+        "tmp_min_free_mb": 1024,
+        "install_order": "largest",
+        "bandwidth_limit_mb": 0,
+        "fetch_engine": "async",
+        "verify_downloads": True,
+        "hash_workers": 4,
+        "compress_on_install": [],
+        "inspect_archives": True,
+        "inspect_max": 500,
+        "metrics": False,
+        "metrics_dir": "",
+        "daemon_socket": "",
+        "mirror_probe_interval": 3600,
+        "mirror_split": True
     }
     try:
         with open(settings_file, 'r') as f:
@@ -42,112 +69,1376 @@ def format_size(n):  # Convert bytes to human readable format
         n /= 1024
     return f"{n:.2f}PB"
 
-def download_file(url, path):  # Download file with resume support
+def format_delta(rows):  # " +added -removed ~resized" for delta rows, empty when nothing changed
+    counts = {"added": 0, "removed": 0, "resized": 0}
+    for row in rows: counts[row[2]] += 1
+    parts = [f"{color}{sign}{counts[k]}\033[0m" for k, sign, color in (("added", "+", "\033[92m"), ("removed", "-", "\033[91m"), ("resized", "~", "\033[33m")) if counts[k]]
+    return " " + " ".join(parts) if parts else ""
+
+_session, _session_lock = None, threading.Lock()
+
+def get_session():  # Get shared keep-alive HTTP session with per-host connection cap
+    import requests
+    from requests.adapters import HTTPAdapter, Retry
+    global _session
+    with _session_lock:
+        if _session is None:
+            settings = load_settings()
+            retry = Retry(total=settings["http_retries"], backoff_factor=settings["http_backoff"], status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True)
+            # One pool per host, blocking at host_connections so extra workers wait instead of opening new sockets
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=settings["host_connections"], pool_block=True, max_retries=retry)
+            session = requests.Session()
+            session.headers["User-Agent"] = "Mozilla/5.0"
+            session.mount("http://", adapter); session.mount("https://", adapter)
+            session.timeout = settings["http_timeout"]
+            _session = session
+        return _session
+
+class TokenBucket:  # Byte-rate limiter shared by all download workers
+    def __init__(self, rate):
+        self.rate, self.tokens, self.stamp, self.lock = rate, rate, time.monotonic(), threading.Lock()
+
+    def consume(self, n):  # Take n bytes of budget, sleeping off any debt
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate) - n
+            self.stamp = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait: time.sleep(wait)
+
+class ThrottledReader:  # File-like wrapper charging reads to the bandwidth limiter
+    def __init__(self, raw, bucket): self.raw, self.bucket = raw, bucket
+
+    def read(self, n=-1):
+        data = self.raw.read(n)
+        if data: self.bucket.consume(len(data))
+        return data
+
+_limiter, _limiter_loaded = None, False
+
+def get_limiter():  # Get global bandwidth limiter, or None when unlimited
+    global _limiter, _limiter_loaded
+    with _session_lock:
+        if not _limiter_loaded:
+            rate = load_settings()["bandwidth_limit_mb"] * 1024**2
+            _limiter, _limiter_loaded = TokenBucket(rate) if rate > 0 else None, True
+        return _limiter
+
+def throttled(chunks):  # Charge downloaded chunks to the bandwidth limiter
+    bucket = get_limiter()
+    for c in chunks:
+        if bucket and c: bucket.consume(len(c))
+        yield c
+
+class Span:  # Timed stage of one item; set .bytes (and .fields) before it closes
+    __slots__ = ('metrics', 'stage', 'item', 'bytes', 'fields', 'start')
+
+    def __init__(self, metrics, stage, item): self.metrics, self.stage, self.item, self.bytes, self.fields = metrics, stage, item, 0, {}
+
+    def __enter__(self): self.start = time.perf_counter(); return self
+
+    def __exit__(self, exc_type, exc, tb): self.metrics.record(self.stage, self.item, time.perf_counter() - self.start, self.bytes, exc_type is not None, **self.fields)
+
+class NullSpan:  # Stand-in returned while metrics are off
+    bytes, fields = 0, {}
+
+    def __setattr__(self, name, value): pass  # Assigned .bytes/.fields are dropped
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): pass
+
+NULL_SPAN = NullSpan()
+
+class Metrics:  # Per-item stage durations and bytes as a JSON-lines trace plus a Prometheus textfile summary
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.prom_path, self.run, self.lock, self.stages = os.path.join(directory, "retro.prom"), f"{int(time.time())}-{os.getpid()}", threading.Lock(), {}
+        self.trace = open(os.path.join(directory, "trace.jsonl"), 'a')
+
+    def span(self, stage, item=None): return Span(self, stage, item)
+
+    def record(self, stage, item, seconds, nbytes=0, error=False, **fields):  # Append one trace event and fold it into the summary
+        line = json.dumps({"ts": round(time.time(), 3), "run": self.run, "stage": stage, "item": item, "seconds": round(seconds, 6), "bytes": nbytes, "error": error, **fields})
+        with self.lock:
+            st = self.stages.setdefault(stage, {"durations": [], "bytes": 0, "errors": 0})
+            st["durations"].append(seconds); st["bytes"] += nbytes; st["errors"] += error
+            if self.trace: self.trace.write(line + "\n")
+
+    def close(self):  # Flush the trace and atomically write the summary for the textfile collector
+        with self.lock:
+            if not self.trace: return
+            self.trace.close(); self.trace = None
+            lines = ["# HELP retro_stage_seconds Duration of retro pipeline stages in the last run.", "# TYPE retro_stage_seconds summary"]
+            for stage, st in sorted(self.stages.items()):
+                d = sorted(st["durations"])
+                for q in (0.5, 0.9, 0.99): lines.append(f'retro_stage_seconds{{stage="{stage}",quantile="{q}"}} {d[min(len(d) - 1, int(q * len(d)))]:.6f}')
+                lines += [f'retro_stage_seconds_sum{{stage="{stage}"}} {sum(d):.6f}', f'retro_stage_seconds_count{{stage="{stage}"}} {len(d)}']
+            for name, key, help in (("retro_stage_bytes", "bytes", "Bytes moved by each stage in the last run."), ("retro_stage_errors", "errors", "Failed items per stage in the last run.")):
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"] + [f'{name}{{stage="{stage}"}} {st[key]}' for stage, st in sorted(self.stages.items())]
+            lines += ["# HELP retro_last_run_timestamp_seconds End of the last run with metrics enabled.", "# TYPE retro_last_run_timestamp_seconds gauge", f"retro_last_run_timestamp_seconds {time.time():.0f}"]
+            tmp = f"{self.prom_path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f: f.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.prom_path)
+
+_metrics, _metrics_loaded = None, False
+
+def enable_metrics():  # Turn metrics on for this process regardless of settings (--metrics)
+    global _metrics, _metrics_loaded
+    with _session_lock:
+        if _metrics is None:
+            _metrics = Metrics(load_settings()["metrics_dir"] or os.path.join(get_config_dir(), "metrics"))
+            atexit.register(_metrics.close)
+        _metrics_loaded = True
+        return _metrics
+
+def get_metrics():  # Get the metrics recorder, or None when metrics are off
+    global _metrics_loaded
+    if not _metrics_loaded:
+        if load_settings()["metrics"]: return enable_metrics()
+        _metrics_loaded = True
+    return _metrics
+
+def span(stage, item=None):  # Time a stage of one item; a shared no-op when metrics are off
+    m = _metrics if _metrics_loaded else get_metrics()
+    return m.span(stage, item) if m else NULL_SPAN
+
+def http_get(url, **kwargs):  # GET through the shared session; the span covers the wait for response headers
+    session = get_session()
+    kwargs.setdefault("timeout", session.timeout)
+    with span("request", url): return session.get(url, **kwargs)
+
+class RomHasher:  # Incremental CRC32/MD5/SHA1 of bytes as they are written
+    def __init__(self): self.size, self.crc, self.md5, self.sha1 = 0, 0, hashlib.md5(), hashlib.sha1()
+
+    def update(self, data):
+        self.size += len(data); self.crc = zlib.crc32(data, self.crc)
+        self.md5.update(data); self.sha1.update(data)
+
+    def result(self): return {"size": self.size, "crc": f"{self.crc:08x}", "md5": self.md5.hexdigest(), "sha1": self.sha1.hexdigest()}
+
+def hash_file(path, hasher=None):  # Hash a file on disk (or feed it into an existing hasher)
+    hasher = hasher or RomHasher()
+    with open(path, 'rb') as f:
+        for c in iter(lambda: f.read(1024**2), b""): hasher.update(c)
+    return hasher
+
+def file_sha1(path):  # SHA1 of a file, or None if it cannot be read
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for c in iter(lambda: f.read(1024**2), b""): h.update(c)
+    except OSError: return None
+    return h.hexdigest()
+
+def copy_stream(src, path, verify=False):  # Copy a file object to path, hashing on the way when verifying
+    hasher = RomHasher() if verify else None
+    with open(path, 'wb') as out:
+        for c in iter(lambda: src.read(1024**2), b""):
+            out.write(c)
+            if hasher: hasher.update(c)
+    return hasher.result() if hasher else None
+
+class RangeNotSupported(Exception): pass  # Server ignored a Range request
+
+def parse_content_range(value):  # Parse "bytes start-end/total" into (start, end, total or None)
+    m = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', value or "")
+    return (int(m.group(1)), int(m.group(2)), None if m.group(3) == '*' else int(m.group(3))) if m else None
+
+def read_range(url, start, end=None):  # Fetch bytes start-end, or the last -start bytes when start is negative; returns (data, offset, total)
+    rng = f"bytes={start}" if start < 0 else f"bytes={start}-{'' if end is None else end}"
+    with http_get(url, headers={'Range': rng, 'Accept-Encoding': 'identity'}, stream=True) as r:
+        if r.status_code != 206: raise RangeNotSupported(f"HTTP {r.status_code} for range request: {url}")
+        cr = parse_content_range(r.headers.get("content-range"))
+        if not cr: raise RangeNotSupported(f"Unexpected Content-Range {r.headers.get('content-range')!r}: {url}")
+        return r.content, cr[0], cr[2]
+
+def zip_members(url):  # List (name, size, crc) of a remote zip from its central directory with a couple of Range reads
+    tail, tail_start, total = read_range(url, -(22 + 65535))  # End of central directory plus the longest possible comment
+    pos = tail.rfind(b"PK\x05\x06")
+    if pos < 0 or len(tail) - pos < 22: raise StreamUnsupported(f"No zip central directory: {url}")
+    count, cd_size, cd_offset = struct.unpack_from("<HII", tail, pos + 10)
+    if (count == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF) and tail[pos - 20:pos - 16] == b"PK\x06\x07":
+        eocd64 = struct.unpack_from("<Q", tail, pos - 12)[0]  # Zip64 locator points at the zip64 end record
+        rec = tail[eocd64 - tail_start:eocd64 - tail_start + 56] if eocd64 >= tail_start else read_range(url, eocd64, eocd64 + 55)[0]
+        if rec[:4] != b"PK\x06\x06": raise StreamUnsupported(f"Bad zip64 end record: {url}")
+        count, cd_size, cd_offset = struct.unpack_from("<QQQ", rec, 32)
+    cd = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size] if cd_offset >= tail_start else read_range(url, cd_offset, cd_offset + cd_size - 1)[0]
+    members, i = [], 0
+    while i + 46 <= len(cd) and cd[i:i + 4] == b"PK\x01\x02":
+        flags, crc, usize, nlen, elen, clen = struct.unpack_from("<H", cd, i + 8) + struct.unpack_from("<I4xI", cd, i + 16) + struct.unpack_from("<HHH", cd, i + 28)
+        name = cd[i + 46:i + 46 + nlen].decode("utf-8" if flags & 0x800 else "cp437", errors="replace")
+        extra, j = cd[i + 46 + nlen:i + 46 + nlen + elen], 0
+        while usize == 0xFFFFFFFF and j + 4 <= len(extra):  # Zip64 extra field carries the real size first
+            tag, size = struct.unpack_from("<HH", extra, j)
+            if tag == 1: usize = struct.unpack_from("<Q", extra, j + 4)[0]
+            j += 4 + size
+        if not name.endswith("/"): members.append((name, usize, f"{crc:08x}"))
+        i += 46 + nlen + elen + clen
+    if count and i == 0: raise StreamUnsupported(f"Unreadable zip central directory: {url}")
+    return members
+
+def download_segments(url, path, total, count, first=None, mirrors=(), key=None):  # Download byte ranges concurrently into a preallocated file, spreading them over equivalent mirror URLs
+    from concurrent.futures import ThreadPoolExecutor
+    state_path, urls, key = path + ".segments", [url, *mirrors], key or url
+    try:
+        with open(state_path, 'r') as f: state = json.load(f)
+        if state["url"] != key or state["total"] != total or os.path.getsize(path) != total: state = None
+    except: state = None
+    if state is None:
+        size = -(-total // count)
+        state = {"url": key, "total": total, "segments": [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]}
+        with open(path, 'wb') as f: f.truncate(total)
+    lock = threading.Lock()
+
+    def save():  # Persist per-segment progress for resume
+        with lock:
+            with open(state_path + ".tmp", 'w') as f: json.dump(state, f)
+            os.replace(state_path + ".tmp", state_path)
+
+    def fetch(seg, src):  # Fetch one segment from src, seg is [start, end, bytes flushed]
+        start, end, done = seg[0], seg[1], seg[2]
+        if start + done > end: return
+        # A fresh download reuses the probing response (bytes=0-) as the first segment
+        r = first if first is not None and start == 0 and done == 0 and src == url else http_get(src, headers={'Range': f'bytes={start + done}-{end}', 'Accept-Encoding': 'identity'}, stream=True)
+        with r, open(path, 'r+b') as f:
+            if r.status_code != 206: raise RangeNotSupported(src)
+            f.seek(start + done)
+            for c in throttled(r.iter_content(65536)):
+                c = c[:end + 1 - start - done]
+                if not c: continue
+                f.write(c); done += len(c)
+                if done - seg[2] >= 8 * 1024**2: f.flush(); seg[2] = done; save()
+                if start + done > end: break
+        seg[2] = done
+        if start + done <= end: raise Exception(f"Incomplete segment {start}-{end}: {path}")
+
+    def fetch_any(i):  # Segments are dealt round-robin over the mirrors; one whose mirror fails is finished from the primary
+        seg, src = state["segments"][i], urls[i % len(urls)]
+        if src == url: return fetch(seg, url)
+        try: fetch(seg, src)
+        except Exception: fetch(seg, url)
+
+    save()
+    try:
+        with ThreadPoolExecutor(max_workers=len(state["segments"])) as exe: list(exe.map(fetch_any, range(len(state["segments"]))))
+    finally:
+        save()
+        if first is not None: first.close()
+    os.remove(state_path)
+
+def download_file(url, path, verify=False, mirrors=(), key=None):  # Download file to .part with a resume record, then rename into place; returns hashes when verifying
+    # mirrors: equivalent URLs to spread segments over; key: identity of the file across mirrors (default url)
+    with span("download", url) as s:
+        hashes = _download_file(url, path, verify, mirrors, key or url)
+        if s is not NULL_SPAN: s.bytes = os.path.getsize(path)
+    return hashes
+
+def _download_file(url, path, verify, mirrors, key):
     path = os.path.normpath(path)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    pos = os.path.getsize(path) if os.path.exists(path) else 0
-    total = int(requests.head(url).headers.get('content-length', 0))
-    headers = {'Range': f'bytes={pos}-'} if pos < total else {}
-    with requests.get(url, headers=headers, stream=True) as r, open(path, 'ab' if pos else 'wb') as f:
-        for c in r.iter_content(8192):
-            if c: f.write(c)
-    if os.path.getsize(path) < total: raise Exception(f"Incomplete download: {path}")
-
-def extract_archive(fp, dst, ext):  # Extract various archive formats
+    settings = load_settings()
+    part, record_path = path + ".part", path + ".part.json"
+    try:
+        with open(record_path, 'r') as f: record = json.load(f)
+        if record.get("url") != key: record = None
+    except: record = None
+    if record is None:
+        for stale in (part, part + ".segments"):
+            if os.path.exists(stale): os.remove(stale)
+        record = {"url": key}
+
+    def save_record():
+        with open(record_path, 'w') as f: json.dump(record, f)
+
+    def finish(hasher=None):
+        if verify and hasher is None: hasher = hash_file(part)  # Segmented and already-complete files are hashed in one pass
+        os.replace(part, path)
+        if os.path.exists(record_path): os.remove(record_path)
+        return hasher.result() if hasher else None
+
+    headers = {'Accept-Encoding': 'identity'}  # Content-Length must match the bytes on disk
+    if os.path.exists(part + ".segments") and record.get("total"):  # Interrupted segmented download resumes by range
+        try: download_segments(url, part, record["total"], settings["segments"], mirrors=mirrors, key=key); return finish()
+        except RangeNotSupported:
+            os.remove(part); os.remove(part + ".segments")
+
+    pos = os.path.getsize(part) if os.path.exists(part) else 0
+    validator = record.get("etag") if record.get("etag") and not record["etag"].startswith("W/") else record.get("last_modified")
+    moved = record.get("source", url) != url  # Resuming a partial file from another mirror: its validators mean nothing here, so the total is compared instead
+    if moved: validator = None
+    r = http_get(url, headers={**headers, 'Range': f'bytes={pos}-', **({'If-Range': validator} if pos and validator else {})}, stream=True)
+    if r.status_code == 206 and pos and moved and (parse_content_range(r.headers.get("content-range")) or (0, 0, None))[2] != record.get("total"):
+        r.close(); pos, r = 0, http_get(url, headers=headers, stream=True)  # Mirror holds a different file: start over
+    if r.status_code == 416 and pos:  # Either nothing is left to fetch or the partial file is stale
+        r.close()
+        if pos == record.get("total"): return finish()
+        pos, r = 0, http_get(url, headers=headers, stream=True)
+    if r.status_code == 206:
+        cr = parse_content_range(r.headers.get("content-range"))
+        if not cr or cr[0] != pos: r.close(); raise Exception(f"Unexpected Content-Range {r.headers.get('content-range')!r}: {url}")
+        total = cr[2]
+    elif r.status_code == 200:
+        pos, total = 0, int(r.headers["content-length"]) if "content-length" in r.headers else None  # Range ignored or file changed: start over
+    else: r.close(); raise Exception(f"HTTP {r.status_code}: {url}")
+    record.update(source=url, total=total, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+    save_record()
+
+    if pos == 0 and r.status_code == 206 and total and total >= settings["segment_threshold_mb"] * 1024**2 and settings["segments"] > 1:
+        try: download_segments(url, part, total, settings["segments"], first=r, mirrors=mirrors, key=key); return finish()
+        except RangeNotSupported:
+            os.remove(part + ".segments")
+            r = http_get(url, headers=headers, stream=True)
+            if r.status_code != 200: r.close(); raise Exception(f"HTTP {r.status_code}: {url}")
+    hasher = (hash_file(part) if pos else RomHasher()) if verify else None  # A resumed prefix is hashed once before appending
+    with r, open(part, 'ab' if pos else 'wb') as f:
+        for c in throttled(r.iter_content(65536)):
+            if c:
+                f.write(c)
+                if hasher: hasher.update(c)
+    if total is not None and os.path.getsize(part) != total: raise Exception(f"Incomplete download: {path}")
+    return finish(hasher)
+
+class MirrorHealth:  # Persisted latency/throughput/error averages per mirror base URL, used to rank equivalent mirrors
+    ALPHA, REF, PROBE = 0.3, 4 * 1024**2, 512 * 1024  # Averaging weight, transfer size a score estimates, bytes read by a probe
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_config_dir(), "mirrors.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f: self.data = json.load(f)
+        except (OSError, ValueError): self.data = {}
+
+    def save(self):  # Atomically write the scores
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self.lock:
+            with open(tmp, 'w') as f: json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def record(self, base, seconds=None, nbytes=0, error=False, latency=None):  # Fold one transfer, probe or failure into the averages
+        def avg(old, new): return new if old is None else old + self.ALPHA * (new - old)
+        with self.lock:
+            e = self.data.setdefault(base, {})
+            e["errors"] = avg(e.get("errors"), 1.0 if error else 0.0)
+            measured = error  # A success without a latency or throughput sample (small listings) says nothing the probe would learn
+            if latency is not None: e["latency"], measured = avg(e.get("latency"), latency), True
+            if seconds and nbytes >= 64 * 1024: e["throughput"], measured = avg(e.get("throughput"), nbytes / seconds), True
+            if measured: e["checked"] = time.time()
+
+    def score(self, base):  # Expected seconds to fetch REF bytes, inflated by the recent error rate; lower is better
+        e = self.data.get(base, {})
+        return (e.get("latency", 0.5) + self.REF / (e.get("throughput") or 1024**2)) * (1 + 9 * e.get("errors", 0))
+
+    def rank(self, bases):  # Mirrors best first; unmeasured ones count as an average mirror and keep their configured order
+        with self.lock: return sorted(bases, key=self.score)
+
+    def split(self, best, others):  # Measured, error-free mirrors at most twice as slow as best, to share its segmented downloads
+        with self.lock: return [b for b in others if b in self.data and self.data[b].get("errors", 0) < 0.05 and self.score(b) <= 2 * self.score(best)]
+
+    def stale(self, base, interval): return time.time() - self.data.get(base, {}).get("checked", 0) >= interval
+
+    def probe(self, targets, timeout):  # Time a small range read of a sample file on each mirror; targets maps base -> file URL
+        from concurrent.futures import ThreadPoolExecutor
+
+        def one(item):
+            base, url = item
+            t = time.perf_counter()
+            try:
+                with http_get(url, headers={'Range': f'bytes=0-{self.PROBE - 1}', 'Accept-Encoding': 'identity'}, stream=True, timeout=timeout) as r:
+                    if r.status_code not in (200, 206): raise Exception(f"HTTP {r.status_code}: {url}")
+                    latency, n = time.perf_counter() - t, 0
+                    for c in r.iter_content(65536):
+                        n += len(c)
+                        if n >= self.PROBE: break
+                self.record(base, time.perf_counter() - t - latency, n, latency=latency)
+            except Exception: self.record(base, error=True)
+
+        with ThreadPoolExecutor(max_workers=min(8, len(targets))) as exe: list(exe.map(one, targets.items()))
+
+def order_packages(pkgs, order):  # Order install jobs: catalog, largest-first or size-interleaved
+    if order not in ("largest", "interleave"): return list(pkgs)
+    by_size = sorted(pkgs, key=lambda f: f.get("size_bytes", 0), reverse=True)
+    if order == "largest": return by_size
+    out, lo, hi = [], 0, len(by_size) - 1  # Alternate biggest and smallest remaining so workers drain evenly
+    while lo <= hi:
+        out.append(by_size[lo]); lo += 1
+        if lo <= hi: out.append(by_size[hi]); hi -= 1
+    return out
+
+def extract_and_remove(fp, dst, ext, verify=False):  # Extract archive then delete it (extraction stage job); returns files, wall start time and duration
+    started, t = time.time(), time.perf_counter()
+    out = extract_archive(fp, dst, ext, verify); os.remove(fp)
+    return out, started, time.perf_counter() - t
+
+def extract_tar(t, dst, verify=False, out=None, stage=False):  # Extract tar members, copying regular files through the hasher (to <target>.part when staging)
+    out = {} if out is None else out
+    for member in t:
+        target = safe_member_path(dst, member.name)
+        if target is None: continue
+        if not member.isfile(): t.extract(member, dst); continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        path = target + ".part" if stage else target
+        out[target] = None  # Registered first so a failed copy is cleaned up
+        out[target] = copy_stream(t.extractfile(member), path, verify)
+        os.utime(path, (member.mtime, member.mtime))
+    return out
+
+def commit_parts(staged):  # Move staged <target>.part files over their targets once the whole archive has been read
+    for target in staged: os.replace(target + ".part", target)
+    return staged
+
+def discard_parts(staged):  # Remove staged .part files after a failed stream; files already at the targets are left alone
+    for target in staged:
+        if os.path.exists(target + ".part"): os.remove(target + ".part")
+
+def extract_archive(fp, dst, ext, verify=False):  # Extract various archive formats, returning {path: hashes or None}
+    import zipfile, tarfile
     fp, dst = os.path.normpath(fp), os.path.normpath(dst)
     os.makedirs(dst, exist_ok=True)
-    extractors = {"zip": lambda: zipfile.ZipFile(fp).extractall(dst), "tar.xz": lambda: tarfile.open(fp, "r:xz").extractall(dst), "7z": lambda: py7zr.SevenZipFile(fp, mode="r").extractall(dst), "rar": lambda: rarfile.RarFile(fp).extractall(dst)}
-    if ext not in extractors: raise Exception(f"Unsupported archive: {ext}")
-    extractors[ext]()
-
-def get_directory_listing(url):  # Parse directory listing from web page
-    r = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-    soup = BeautifulSoup(r.text, "html.parser")
-    t = soup.find(lambda tag: tag.name == "table" and ("directory-listing-table" in tag.get("class", []) or tag.get("id") == "list"))
-    if not t: return []
-    h = [th.text.strip().lower() for th in t.find_all("th")]
-    name_idx, size_idx = h.index("name") if "name" in h else 0, h.index("size") if "size" in h else None
-    out, tbody = [], t.find("tbody")
-    if not tbody: return out
-    for tr in tbody.find_all("tr"):
-        td = tr.find_all("td")
-        if not td: continue
-        a = td[name_idx].find("a")
-        if not a: continue
-        if "parent directory" in a.text.lower(): continue
-        name, link = a.text.strip(), a["href"]
-        sz = td[size_idx].text.strip() if size_idx is not None and size_idx < len(td) else ((tr.find("td", class_="size") or (td[2] if len(td)>2 else None)))
-        sz = sz.text.strip() if hasattr(sz, "text") else (sz or "")
-        out.append({"name":name, "link":link, "size_str":sz, "size_bytes":parse_size(sz), "base":url})
-    return out
+    if ext == "zip":
+        out = {}
+        with zipfile.ZipFile(fp) as z:
+            for info in z.infolist():
+                target = safe_member_path(dst, info.filename)
+                if target is None: continue
+                if info.is_dir(): os.makedirs(target, exist_ok=True); continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with z.open(info) as src: out[target] = copy_stream(src, target, verify)
+        return out
+    if ext == "tar.xz":
+        with tarfile.open(fp, "r:xz") as t: return extract_tar(t, dst, verify)
+    if ext == "7z":
+        import py7zr
+        with py7zr.SevenZipFile(fp, mode="r") as z: names = z.getnames(); z.extractall(dst)
+    elif ext == "rar":
+        import rarfile
+        with rarfile.RarFile(fp) as z: names = z.namelist(); z.extractall(dst)
+    else: raise Exception(f"Unsupported archive: {ext}")
+    # 7z/rar extract through their own writers, so members are hashed after the fact
+    paths = [p for p in (safe_member_path(dst, n) for n in names) if p and os.path.isfile(p)]
+    return {p: hash_file(p).result() if verify else None for p in paths}
+
+class StreamUnsupported(Exception): pass  # Archive member cannot be decoded sequentially
+
+class StreamReader:  # Exact-size reads with push-back over a forward-only stream
+    def __init__(self, raw): self.raw, self.buf = raw, b""
+
+    def read(self, n):  # Read up to n bytes
+        if self.buf: out, self.buf = self.buf[:n], self.buf[n:]; return out
+        return self.raw.read(n)
+
+    def read_exact(self, n):  # Read exactly n bytes or fail
+        out = b""
+        while len(out) < n:
+            c = self.read(n - len(out))
+            if not c: raise Exception("Unexpected end of archive stream")
+            out += c
+        return out
+
+    def unread(self, data): self.buf = data + self.buf
+
+def safe_member_path(dst, name):  # Map archive member name to a path inside dst
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return os.path.join(dst, *parts) if parts else None
+
+def extract_zip_stream(raw, dst, verify=False):  # Extract zip members from local headers as bytes arrive, returning {path: hashes or None}
+    reader, staged, seen = StreamReader(raw), {}, False  # Members stay .part until every CRC has checked out
+    try:
+        while True:
+            sig = reader.read_exact(4)
+            if sig in (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06"): break  # Central directory: all members seen
+            if sig != b"PK\x03\x04": raise (StreamUnsupported if seen else Exception)("Invalid zip local header")  # Lost sync mid-archive: fall back to the seekable path
+            seen = True
+            _, flags, method, _, _, crc, csize, usize, nlen, xlen = struct.unpack("<HHHHHIIIHH", reader.read_exact(26))
+            name = reader.read_exact(nlen).decode("utf-8" if flags & 0x800 else "cp437")
+            extra, zip64 = reader.read_exact(xlen), False
+            while len(extra) >= 4:
+                hid, hlen = struct.unpack("<HH", extra[:4])
+                if hid == 0x0001:
+                    zip64, vals = True, list(struct.unpack(f"<{hlen // 8}Q", extra[4:4 + hlen // 8 * 8]))
+                    if usize == 0xFFFFFFFF and vals: usize = vals.pop(0)
+                    if csize == 0xFFFFFFFF and vals: csize = vals.pop(0)
+                extra = extra[4 + hlen:]
+            if flags & 0x1: raise StreamUnsupported(f"Encrypted member: {name}")
+            if method not in (0, 8, 12) or (method == 0 and flags & 0x8): raise StreamUnsupported(f"Cannot stream member: {name}")
+            target = safe_member_path(dst, name)
+            skip = target is None or name.endswith("/")
+            if skip:
+                if target: os.makedirs(target, exist_ok=True)
+                if method == 0 or not flags & 0x8: reader.read_exact(csize)
+                else: _inflate_member(reader, method, None)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                staged[target], hasher = None, RomHasher() if verify else None
+                with open(target + ".part", "wb") as out:
+                    actual = _inflate_member(reader, method, out, csize if method == 0 else None, hasher)
+            if flags & 0x8:  # Data descriptor follows the compressed data, skipped members included
+                d = reader.read_exact(4)
+                if d == b"PK\x07\x08": d = reader.read_exact(4)
+                crc = struct.unpack("<I", d)[0]; reader.read_exact(16 if zip64 else 8)
+            if skip: continue
+            if actual != crc: raise Exception(f"CRC mismatch: {name}")
+            staged[target] = hasher.result() if hasher else None
+    except BaseException:
+        discard_parts(staged); raise
+    return commit_parts(staged)
+
+def extract_tar_stream(raw, dst, verify=False):  # Extract a tar.xz stream, moving members into place only once it has been read to the end
+    import tarfile
+    staged = {}
+    try:
+        with tarfile.open(fileobj=raw, mode="r|xz") as t: extract_tar(t, dst, verify, staged, stage=True)
+    except BaseException:
+        discard_parts(staged); raise
+    return commit_parts(staged)
+
+def _inflate_member(reader, method, out, size=None, hasher=None):  # Copy or decompress one member, returning its CRC32
+    import bz2
+    crc = 0
+    if method == 0:
+        while size:
+            c = reader.read(min(size, 65536))
+            if not c: raise Exception("Unexpected end of archive stream")
+            size -= len(c); crc = zlib.crc32(c, crc)
+            if out: out.write(c)
+            if hasher: hasher.update(c)
+        return crc
+    d = zlib.decompressobj(-15) if method == 8 else bz2.BZ2Decompressor()
+    while not d.eof:
+        c = reader.read(65536)
+        if not c: raise Exception("Unexpected end of archive stream")
+        data = d.decompress(c)
+        if data:
+            crc = zlib.crc32(data, crc)
+            if out: out.write(data)
+            if hasher: hasher.update(data)
+    if d.unused_data: reader.unread(d.unused_data)
+    return crc
+
+def stream_extract(url, dst, ext, verify=False):  # Download and unpack a zip/tar.xz in one pass without a temp archive
+    with span("stream", url) as s:
+        files = _stream_extract(url, dst, ext, verify)
+        if s is not NULL_SPAN: s.bytes = sum(os.path.getsize(p) for p in files if os.path.isfile(p))
+    return files
+
+def _stream_extract(url, dst, ext, verify):
+    dst = os.path.normpath(dst)
+    os.makedirs(dst, exist_ok=True)
+    with http_get(url, headers={'Accept-Encoding': 'identity'}, stream=True) as r:
+        if r.status_code != 200: raise Exception(f"HTTP {r.status_code}: {url}")
+        r.raw.decode_content = True
+        raw = ThrottledReader(r.raw, get_limiter()) if get_limiter() else r.raw
+        return (extract_zip_stream if ext == "zip" else extract_tar_stream)(raw, dst, verify)
+
+def listing_cache_path(url):  # Get cache file path for a listing URL
+    cache_dir = os.path.join(get_config_dir(), "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def load_cached_listing(url):  # Load cached listing entry for URL
+    try:
+        with open(listing_cache_path(url), 'r') as f: entry = json.load(f)
+        return entry if entry.get("url") == url else None
+    except: return None
+
+def save_cached_listing(url, etag, last_modified, files):  # Atomically store listing entry for URL
+    path = listing_cache_path(url)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f: json.dump({"url": url, "etag": etag, "last_modified": last_modified, "files": files}, f)
+    os.replace(tmp, path)
+
+class ListingParser(HTMLParser):  # Incremental directory listing table parser
+    def __init__(self, url):
+        super().__init__(convert_charrefs=True)
+        self.url, self.records = url, []
+        self.depth, self.done, self.tbody = 0, False, None  # depth of listing table, tbody state: None/open/closed
+        self.headers, self.th, self.row, self.td, self.a = [], None, None, None, None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done: return
+        if tag == "table":
+            if self.depth: self.depth += 1
+            else:
+                at = dict(attrs)
+                if "directory-listing-table" in (at.get("class") or "").split() or at.get("id") == "list": self.depth = 1
+            return
+        if not self.depth: return
+        if tag == "th": self.th = []
+        elif tag == "tbody" and self.tbody is None: self.tbody = "open"
+        elif self.tbody != "open": return
+        elif tag == "tr": self.row = []
+        elif tag == "td" and self.row is not None:
+            self.td = {"text": [], "class": (dict(attrs).get("class") or "").split(), "a": None}
+            self.row.append(self.td)
+        elif tag == "a" and self.td is not None and self.td["a"] is None:
+            self.a = {"href": dict(attrs).get("href"), "text": []}
+            self.td["a"] = self.a
+
+    def handle_endtag(self, tag):
+        if not self.depth or self.done: return
+        if tag == "table":
+            self.depth -= 1
+            if not self.depth: self.done = True
+        elif tag == "th" and self.th is not None: self.headers.append("".join(self.th).strip().lower()); self.th = None
+        elif tag == "a": self.a = None
+        elif tag == "td": self.td, self.a = None, None
+        elif tag == "tr" and self.row is not None: self._emit(self.row); self.row, self.td, self.a = None, None, None
+        elif tag == "tbody" and self.tbody == "open": self.tbody = "closed"
+
+    def handle_data(self, data):
+        if not self.depth or self.done: return
+        if self.th is not None: self.th.append(data)
+        if self.td is not None: self.td["text"].append(data)
+        if self.a is not None: self.a["text"].append(data)
+
+    def _emit(self, td):  # Convert a completed table row to a package record
+        h = self.headers
+        name_idx, size_idx = h.index("name") if "name" in h else 0, h.index("size") if "size" in h else None
+        if not td or name_idx >= len(td): return
+        a = td[name_idx]["a"]
+        if not a or a["href"] is None: return
+        text = "".join(a["text"])
+        if "parent directory" in text.lower(): return
+        if size_idx is not None and size_idx < len(td): sz = td[size_idx]
+        else: sz = next((c for c in td if "size" in c["class"]), td[2] if len(td) > 2 else None)
+        sz = "".join(sz["text"]).strip() if sz else ""
+        self.records.append({"name":text.strip(), "link":a["href"], "size_str":sz, "size_bytes":parse_size(sz), "base":self.url})
+
+    def drain(self):  # Pop records parsed so far
+        out, self.records = self.records, []
+        return out
+
+def rebase(records, mirror, base):  # Listing records fetched from a mirror, attributed to the base URL it stands in for
+    return records if mirror == base else [{**r, "base": base} for r in records]
+
+def parse_directory_listing(html, url):  # Parse directory listing table from HTML
+    p = ListingParser(url); p.feed(html); p.close()
+    return p.drain()
+
+def listing_charset(content_type):  # Charset from a Content-Type header, UTF-8 when absent (same rule for both fetch engines)
+    m = re.search(r'charset=([\w-]+)', content_type or "")
+    try: return codecs.lookup(m.group(1)).name if m else "utf-8"
+    except LookupError: return "utf-8"
+
+def iter_directory_listing(url, cache=False):  # Stream directory listing records while the page downloads
+    headers, entry = {}, load_cached_listing(url) if cache else None
+    if entry:
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+    with span("listing", url) as s, http_get(url, headers=headers, stream=True) as r:
+        if entry and r.status_code == 304: s.fields = {"cached": True, "entries": len(entry["files"])}; yield from entry["files"]; return
+        if r.status_code != 200: raise Exception(f"HTTP {r.status_code}: {url}")  # A missing page is a failed source, not an empty one
+        p, out, size = ListingParser(url), [], 0
+        dec = codecs.getincrementaldecoder(listing_charset(r.headers.get("Content-Type")))(errors="replace")
+        for c in r.iter_content(65536):
+            p.feed(dec.decode(c)); size += len(c)
+            for f in p.drain(): out.append(f); yield f
+            if p.done: break
+        p.feed(dec.decode(b"", final=True)); p.close()
+        for f in p.drain(): out.append(f); yield f
+        s.bytes, s.fields = size, {"cached": False, "entries": len(out)}
+        if r.status_code == 200: save_cached_listing(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), out)
+
+def get_directory_listing(url, cache=False):  # Fetch directory listing, revalidating cached copy when enabled
+    return list(iter_directory_listing(url, cache))
+
+class RetryableStatus(Exception): pass  # Server answered 429/5xx
+
+class AsyncListingFetcher:  # asyncio HTTP/1.1 client that parses listings as the body arrives
+    def __init__(self, settings):
+        import asyncio
+        self.limit, self.per_host = asyncio.Semaphore(settings["fetch_workers"]), settings["host_connections"]
+        self.timeout, self.retries, self.backoff = settings["http_timeout"], settings["http_retries"], settings["http_backoff"]
+        self.hosts, self.idle, self.ssl = {}, {}, None
+
+    async def fetch(self, url, cache=False):  # Fetch one listing URL with conditional revalidation and retries
+        import asyncio
+        entry, headers = load_cached_listing(url) if cache else None, {}
+        if entry:
+            if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+        with span("listing", url) as s:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self.limit: status, resp_headers, records = await self.get(url, url, headers)
+                    break
+                except (OSError, asyncio.TimeoutError, RetryableStatus):
+                    if attempt == self.retries: raise
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+            s.fields = {"cached": bool(entry and status == 304), "entries": len(entry["files"] if entry and status == 304 else records), "attempts": attempt + 1}
+            if status != 200 and not (entry and status == 304): raise Exception(f"HTTP {status}: {url}")
+        if entry and status == 304: return entry["files"]
+        if status == 200: save_cached_listing(url, resp_headers.get("etag"), resp_headers.get("last-modified"), records)
+        return records
+
+    async def get(self, url, base, headers, redirects=5):  # GET url, following redirects, parsing a 200 body into records
+        import asyncio
+        while True:
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            async with self.hosts.setdefault(key, asyncio.Semaphore(self.per_host)):
+                status, resp_headers, records = await self.request(key, parts, base, headers)
+            if status in (301, 302, 303, 307, 308) and resp_headers.get("location") and redirects > 0:
+                url, redirects = urljoin(url, resp_headers["location"]), redirects - 1
+                continue
+            if status == 429 or status >= 500: raise RetryableStatus(f"HTTP {status}: {url}")
+            return status, resp_headers, records
+
+    async def open(self, key):  # Open a new connection to (scheme, host, port)
+        import asyncio, ssl
+        if key[0] == "https" and self.ssl is None: self.ssl = ssl.create_default_context()
+        return await asyncio.wait_for(asyncio.open_connection(key[1], key[2], ssl=self.ssl if key[0] == "https" else None), self.timeout)
+
+    async def connect(self, key):  # Reuse an idle keep-alive connection or open a new one
+        idle = self.idle.get(key)
+        if idle: return idle.pop() + (True,)
+        return await self.open(key) + (False,)
+
+    async def request(self, key, parts, base, headers):  # Send one request and read the response on a pooled connection
+        import asyncio
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        host = parts.hostname + (f":{parts.port}" if parts.port else "")
+        req = f"GET {target} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: Mozilla/5.0\r\nAccept-Encoding: identity\r\n"
+        req = (req + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n").encode("latin-1")
+        reader, writer, reused = await self.connect(key)
+        try:
+            writer.write(req); await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not line and reused:  # Server dropped the idle connection: retry once on a fresh one
+                writer.close()
+                reader, writer = await self.open(key)
+                writer.write(req); await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+            try: status = int(line.split()[1])
+            except (IndexError, ValueError): raise ConnectionError(f"Malformed status line: {line[:80]!r}")  # Empty or garbled: retryable
+            resp_headers = {}
+            while True:
+                h = await asyncio.wait_for(reader.readline(), self.timeout)
+                if h in (b"\r\n", b"\n", b""): break
+                k, _, v = h.decode("latin-1").partition(":")
+                resp_headers[k.strip().lower()] = v.strip()
+            parser = ListingParser(base) if status == 200 else None
+            dec = codecs.getincrementaldecoder(listing_charset(resp_headers.get("content-type")))(errors="replace")
+            keep = resp_headers.get("connection", "").lower() != "close"
+            async for c in self.body(reader, status, resp_headers):
+                if parser: parser.feed(dec.decode(c))
+            if "content-length" not in resp_headers and "chunked" not in resp_headers.get("transfer-encoding", "").lower() and status not in (204, 304): keep = False
+            records = []
+            if parser: parser.feed(dec.decode(b"", final=True)); parser.close(); records = parser.drain()
+        except BaseException:
+            writer.close(); raise
+        if keep: self.idle.setdefault(key, []).append((reader, writer))
+        else: writer.close()
+        return status, resp_headers, records
+
+    async def body(self, reader, status, headers):  # Yield body chunks for Content-Length, chunked or close-delimited responses
+        import asyncio
+        if status in (204, 304) or 100 <= status < 200: return
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                try: size = int(line.split(b";")[0].strip() or b"0", 16)
+                except ValueError: raise ConnectionError(f"Malformed chunk size: {line[:80]!r}")
+                if size == 0:
+                    while (await asyncio.wait_for(reader.readline(), self.timeout)) not in (b"\r\n", b"\n", b""): pass
+                    return
+                try: c = await asyncio.wait_for(reader.readexactly(size), self.timeout)
+                except asyncio.IncompleteReadError: raise ConnectionError("Connection closed mid-chunk")  # Truncated body: retryable like any dropped connection
+                yield c
+                await asyncio.wait_for(reader.readline(), self.timeout)
+        elif "content-length" in headers:
+            left = int(headers["content-length"])
+            while left > 0:
+                c = await asyncio.wait_for(reader.read(min(left, 65536)), self.timeout)
+                if not c: raise ConnectionError("Connection closed mid-body")
+                left -= len(c); yield c
+        else:
+            while True:
+                c = await asyncio.wait_for(reader.read(65536), self.timeout)
+                if not c: return
+                yield c
+
+    def close(self):  # Close idle keep-alive connections
+        for conns in self.idle.values():
+            for _, writer in conns: writer.close()
+        self.idle.clear()
+
+class PackageRecord(Mapping):  # Read-only dict view of one PackageTable row
+    __slots__ = ('table', 'i')
+    KEYS = ("name", "link", "size_str", "size_bytes", "base", "system")
+
+    def __init__(self, table, i): self.table, self.i = table, i
+
+    def __getitem__(self, key):
+        t, i = self.table, self.i
+        if key == "name": return t.name(i)
+        if key == "link": return t.link(i)
+        if key == "size_str": return t.size_strs[t.size_str_idx[i]]
+        if key == "size_bytes": return t.sizes[i]
+        if key == "base": return t.bases[t.base_idx[i]]
+        if key == "system": return t.systems[t.system_idx[i]]
+        raise KeyError(key)
+
+    def __iter__(self): return iter(self.KEYS)
+
+    def __len__(self): return len(self.KEYS)
+
+    def __repr__(self): return repr(dict(self))
+
+class PackageTable:  # Columnar package list: interned systems/bases/size strings, parallel arrays, names in one buffer
+    def __init__(self, records=()):
+        self.systems, self.bases, self.size_strs = [], [], []
+        self.system_pos, self.base_pos, self.size_str_pos = {}, {}, {}  # Value -> index in each interned table
+        self.system_idx, self.base_idx, self.size_str_idx = array('H'), array('I'), array('I')
+        self.sizes, self.name_end, self.link_end = array('q'), array('Q'), array('Q')
+        self.names, self.links = bytearray(), bytearray()  # A link equal to its name is stored as an empty slice
+        self.extend(records)
+
+    def append(self, f): self.extend((f,))  # Add one record (any mapping with the package keys)
+
+    def extend(self, records):
+        systems, bases, size_strs = self.systems, self.bases, self.size_strs
+        sys_pos, base_pos, str_pos = self.system_pos, self.base_pos, self.size_str_pos
+        names, links, name_end, link_end = self.names, self.links, self.name_end, self.link_end
+        for f in records:
+            name, link, sy, base, ss = f["name"], f["link"], f["system"], f["base"], f["size_str"]
+            i = sys_pos.get(sy)
+            if i is None: i = sys_pos[sy] = len(systems); systems.append(sy)
+            self.system_idx.append(i)
+            i = base_pos.get(base)
+            if i is None: i = base_pos[base] = len(bases); bases.append(base)
+            self.base_idx.append(i)
+            i = str_pos.get(ss)
+            if i is None: i = str_pos[ss] = len(size_strs); size_strs.append(ss)
+            self.size_str_idx.append(i)
+            self.sizes.append(f["size_bytes"])
+            names += name.encode(); name_end.append(len(names))
+            if link != name: links += link.encode()
+            link_end.append(len(links))
+
+    def name(self, i): return self.names[self.name_end[i - 1] if i else 0:self.name_end[i]].decode()
+
+    def link(self, i):
+        start = self.link_end[i - 1] if i else 0
+        return self.links[start:self.link_end[i]].decode() if self.link_end[i] > start else self.name(i)
+
+    def __len__(self): return len(self.sizes)
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return PackageRecord(self, i)
+
+    def __iter__(self): return (PackageRecord(self, i) for i in range(len(self)))
+
+    def rows(self):  # (system, name, link, size_str, size_bytes, base) tuples without building records
+        for i in range(len(self)):
+            yield self.systems[self.system_idx[i]], self.name(i), self.link(i), self.size_strs[self.size_str_idx[i]], self.sizes[i], self.bases[self.base_idx[i]]
+
+    def system_totals(self):  # {system: (count, total bytes)} in one pass over the arrays
+        counts, totals = [0] * len(self.systems), [0] * len(self.systems)
+        for s, size in zip(self.system_idx, self.sizes): counts[s] += 1; totals[s] += size
+        return {sys_name: (counts[i], totals[i]) for i, sys_name in enumerate(self.systems)}
+
+class Catalog:  # Indexed SQLite package catalog
+    HISTORY = 10  # Updates whose deltas are kept
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_config_dir(), "packages.db")
+        self.held = None
+
+    def exists(self): return os.path.exists(self.path)
+
+    def connect(self):
+        if self.held: return self.held
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA mmap_size = 268435456")  # Read pages straight from the mapped file instead of copying them into the page cache
+        return db
+
+    def release(self, db):  # Close a connection from connect() unless it is the held in-memory copy
+        if db is not self.held: db.close()
+
+    def hold(self):  # Keep an in-memory copy of the catalog for a long-running process; call again after the file changes
+        disk = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True)  # Read-only, so holding it raises no write notifications
+        try:
+            mem = sqlite3.connect(":memory:", check_same_thread=False)
+            disk.backup(mem)
+        finally: disk.close()
+        old, self.held = self.held, mem
+        if old: old.close()
+
+    def write(self, files):  # Rebuild catalog atomically from package records; returns the delta against the old catalog (None if there was none)
+        if not isinstance(files, PackageTable): files = PackageTable(files)
+        delta = None
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp): os.remove(tmp)
+        db = sqlite3.connect(tmp)
+        try:
+            db.executescript("""
+                PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;
+                CREATE TABLE packages (id INTEGER PRIMARY KEY, system TEXT, system_lower TEXT, name TEXT, name_lower TEXT, link TEXT, size_str TEXT, size_bytes INTEGER, base TEXT);
+            """)
+            db.executemany("INSERT INTO packages (system, system_lower, name, name_lower, link, size_str, size_bytes, base) VALUES (?,?,?,?,?,?,?,?)",
+                ((sy, sy.lower(), n, n.lower(), l, ss, sb, b) for sy, n, l, ss, sb, b in files.rows()))
+            db.execute("CREATE INDEX packages_system ON packages (system_lower, size_bytes)")
+            self.create_member_tables(db)
+            db.executescript("""
+                CREATE TABLE updates (id INTEGER PRIMARY KEY, time REAL, base_time REAL);
+                CREATE TABLE changes (update_id INTEGER, system TEXT, name TEXT, change TEXT, old_size INTEGER, new_size INTEGER);
+            """)
+            base = None
+            if os.path.exists(self.path):  # Keep inspected archive contents for packages that did not change
+                db.execute("ATTACH DATABASE ? AS old", (self.path,))
+                try:
+                    db.execute("INSERT INTO archives SELECT a.* FROM old.archives a WHERE EXISTS (SELECT 1 FROM packages p WHERE p.base || p.link = a.url AND p.size_bytes = a.package_size)")
+                    db.execute("INSERT INTO members SELECT m.* FROM old.members m WHERE m.url IN (SELECT url FROM archives)")
+                except sqlite3.OperationalError: pass  # Catalog from before archive inspection
+                try:
+                    db.execute(f"INSERT INTO updates SELECT * FROM old.updates ORDER BY id DESC LIMIT {self.HISTORY - 1}")
+                    db.execute("INSERT INTO changes SELECT * FROM old.changes WHERE update_id IN (SELECT id FROM updates)")
+                    base = db.execute("SELECT max(time) FROM old.updates").fetchone()[0]
+                except sqlite3.OperationalError: pass  # Catalog from before change tracking
+                if base is None: base = os.path.getmtime(self.path)
+                delta = self.diff(db, files)
+                db.commit(); db.execute("DETACH DATABASE old")
+            update = db.execute("INSERT INTO updates (time, base_time) VALUES (?,?)", (time.time(), base)).lastrowid
+            db.executemany("INSERT INTO changes VALUES (?,?,?,?,?,?)", ((update, *c) for c in delta or ()))
+            try:  # Trigram FTS turns substring keywords into index lookups (SQLite >= 3.34)
+                db.execute("CREATE VIRTUAL TABLE packages_fts USING fts5(name_lower, content='packages', content_rowid='id', tokenize='trigram')")
+                db.execute("INSERT INTO packages_fts (packages_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError: pass
+            db.commit()
+        finally: db.close()
+        os.replace(tmp, self.path)
+        return delta
+
+    def diff(self, db, files):  # Delta rows (system, name, change, old_size, new_size) against the attached old catalog, hash-joined on (system, name)
+        old = {(sy, n): sb for sy, n, sb in db.execute("SELECT system, name, size_bytes FROM old.packages")}
+        out, seen = [], set()
+        for sy, n, l, ss, sb, b in files.rows():
+            if (sy, n) in seen: continue  # Same name listed by two mirrors
+            seen.add((sy, n))
+            before = old.pop((sy, n), None)
+            if before is None: out.append((sy, n, "added", None, sb))
+            elif before != sb: out.append((sy, n, "resized", before, sb))
+        out.extend((sy, n, "removed", sb, None) for (sy, n), sb in old.items())
+        return out
+
+    def changes(self, since=None):  # Delta rows of the last update, or of every update after time since; None if the kept history does not reach back that far
+        db = self.connect()
+        try:
+            try:
+                if since is None: return db.execute("SELECT system, name, change, old_size, new_size FROM changes WHERE update_id = (SELECT max(id) FROM updates)").fetchall()
+                first = db.execute("SELECT base_time FROM updates ORDER BY id LIMIT 1").fetchone()
+                if first is None or (first[0] is not None and first[0] > since): return None
+                return db.execute("SELECT c.system, c.name, c.change, c.old_size, c.new_size FROM changes c JOIN updates u ON u.id = c.update_id WHERE u.time > ?", (since,)).fetchall()
+            except sqlite3.OperationalError: return None  # Catalog from before change tracking
+        finally: self.release(db)
+
+    def create_member_tables(self, db):  # Remote archive contents; members = -1 marks archives that could not be inspected
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS archives (url TEXT PRIMARY KEY, package_size INTEGER, members INTEGER, unpacked_size INTEGER);
+            CREATE TABLE IF NOT EXISTS members (url TEXT, name TEXT, size INTEGER, crc TEXT);
+            CREATE INDEX IF NOT EXISTS members_url ON members (url);
+        """)
+
+    def archive_members(self, pkgs):  # {url: [(name, size, crc)] or None if uninspectable} for packages inspected at their current size
+        db = self.connect()
+        try:
+            self.create_member_tables(db)
+            out = {}
+            for f in pkgs:
+                url = f["base"] + f["link"]
+                row = db.execute("SELECT members FROM archives WHERE url = ? AND package_size = ?", (url, f["size_bytes"])).fetchone()
+                if row: out[url] = None if row[0] < 0 else db.execute("SELECT name, size, crc FROM members WHERE url = ?", (url,)).fetchall()
+            return out
+        finally: self.release(db)
+
+    def store_members(self, inspected):  # Save [(package, members or None)] from remote inspection
+        db = self.connect()
+        try:
+            self.create_member_tables(db)
+            for f, members in inspected:
+                url = f["base"] + f["link"]
+                db.execute("DELETE FROM members WHERE url = ?", (url,))
+                db.execute("INSERT OR REPLACE INTO archives VALUES (?,?,?,?)", (url, f["size_bytes"], -1 if members is None else len(members), sum(m[1] for m in members or ())))
+                db.executemany("INSERT INTO members VALUES (?,?,?,?)", ((url, *m) for m in members or ()))
+            db.commit()
+        finally: self.release(db)
+
+    def query(self, inc=(), kw=(), exc=(), system=None):  # Find packages by system, keywords and exclusions
+        db = self.connect()
+        try:
+            where, args = [], []
+            if system is not None: where.append("system_lower = ?"); args.append(system.lower())
+            elif inc: where.append(f"system_lower IN ({','.join('?' * len(inc))})"); args.extend(s.lower() for s in inc)
+            if system is None:
+                kw, exc = [k.lower() for k in kw], [e.lower() for e in exc]
+                fts = [k for k in kw if len(k) >= 3]
+                if fts and db.execute("SELECT 1 FROM sqlite_master WHERE name = 'packages_fts'").fetchone():
+                    where.append("id IN (SELECT rowid FROM packages_fts WHERE packages_fts MATCH ?)")
+                    args.append(" AND ".join('"' + k.replace('"', '""') + '"' for k in fts))
+                for k in kw: where.append("instr(name_lower, ?) > 0"); args.append(k)
+                for e in exc: where.append("instr(name_lower, ?) = 0"); args.append(e)
+            sql = "SELECT system, name, link, size_str, size_bytes, base FROM packages" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id"
+            return PackageTable({"name": n, "link": l, "size_str": ss, "size_bytes": sb, "base": b, "system": sy} for sy, n, l, ss, sb, b in db.execute(sql, args))
+        finally: self.release(db)
+
+def parse_dat(fileobj):  # Yield (game, name, size, crc, md5, sha1) rows from a Logiqx XML DAT
+    from xml.etree import ElementTree
+    game = None
+    for event, elem in ElementTree.iterparse(fileobj, events=("start", "end")):
+        if elem.tag in ("game", "machine"):
+            if event == "start": game = elem.get("name")
+            else: elem.clear()
+        elif elem.tag == "rom" and event == "end":
+            yield (game, elem.get("name"), int(elem.get("size") or 0), *((elem.get(k) or "").lower() or None for k in ("crc", "md5", "sha1")))
+
+class HashDB:  # Local SQLite database of DAT entries and verified file hashes
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_config_dir(), "hashes.db")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dat_sources (system TEXT, source TEXT, stamp TEXT, PRIMARY KEY (system, source));
+            CREATE TABLE IF NOT EXISTS dat (system TEXT, source TEXT, game TEXT, name TEXT, size INTEGER, crc TEXT, md5 TEXT, sha1 TEXT);
+            CREATE INDEX IF NOT EXISTS dat_name ON dat (system, name);
+            CREATE INDEX IF NOT EXISTS dat_sha1 ON dat (system, sha1);
+            CREATE INDEX IF NOT EXISTS dat_crc ON dat (system, crc, size);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, system TEXT, size INTEGER, mtime INTEGER, crc TEXT, md5 TEXT, sha1 TEXT, status TEXT);
+        """)
+
+    def close(self): self.db.close()
+
+    def load_dat(self, system, source):  # Import a DAT (path relative to the config dir, or URL) when new or changed
+        import zipfile
+        with self.lock: row = self.db.execute("SELECT stamp FROM dat_sources WHERE system = ? AND source = ?", (system, source)).fetchone()
+        if source.startswith(("http://", "https://")):
+            r = http_get(source, headers={"If-None-Match": row[0]} if row else {})
+            if r.status_code == 304: return
+            if r.status_code != 200: raise Exception(f"HTTP {r.status_code}: {source}")
+            data, stamp = r.content, r.headers.get("ETag") or hashlib.sha1(r.content).hexdigest()
+            if row and row[0] == stamp: return
+        else:
+            path = os.path.join(get_config_dir(), os.path.expanduser(source))
+            st = os.stat(path)
+            stamp = f"{st.st_mtime_ns}:{st.st_size}"
+            if row and row[0] == stamp: return
+            with open(path, 'rb') as f: data = f.read()
+        if data[:2] == b"PK":  # Zipped DAT as distributed by No-Intro/Redump
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                data = z.read(next(n for n in z.namelist() if n.lower().endswith((".dat", ".xml"))))
+        rows = [(system, source) + r for r in parse_dat(io.BytesIO(data))]
+        with self.lock:
+            self.db.execute("DELETE FROM dat WHERE system = ? AND source = ?", (system, source))
+            self.db.executemany("INSERT INTO dat VALUES (?,?,?,?,?,?,?,?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO dat_sources VALUES (?,?,?)", (system, source, stamp))
+            self.db.commit()
+
+    def verify(self, system, path, h):  # Check hashes against the system's DAT: verified, bad, unknown or unchecked
+        def match(size, crc, md5, sha1): return size == h["size"] and (sha1 == h["sha1"] if sha1 else md5 == h["md5"] if md5 else crc == h["crc"])
+        with self.lock:
+            rows = self.db.execute("SELECT size, crc, md5, sha1 FROM dat WHERE system = ? AND name = ?", (system, os.path.basename(path))).fetchall()
+            if any(match(*r) for r in rows): return "verified"
+            if self.db.execute("SELECT 1 FROM dat WHERE system = ? AND (sha1 = ? OR (sha1 IS NULL AND crc = ? AND size = ?)) LIMIT 1", (system, h["sha1"], h["crc"], h["size"])).fetchone(): return "verified"
+            if rows: return "bad"  # Known file name with different contents: corrupt or truncated dump
+            return "unknown" if self.db.execute("SELECT 1 FROM dat WHERE system = ? LIMIT 1", (system,)).fetchone() else "unchecked"
+
+    def cached(self, entries):  # Map path to known SHA1 for (path, size, mtime_ns) entries that are unchanged
+        out = {}
+        with self.lock:
+            for path, size, mtime in entries:
+                row = self.db.execute("SELECT sha1 FROM files WHERE path = ? AND size = ? AND mtime = ?", (os.path.abspath(path), size, mtime)).fetchone()
+                if row and row[0]: out[path] = row[0]
+        return out
+
+    def store_hashes(self, rows):  # Cache SHA1 of (path, system, size, mtime_ns, sha1) rows hashed outside an install
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO files (path, system, size, mtime, sha1, status) VALUES (?,?,?,?,?,'unchecked')", ((os.path.abspath(p), sy, sz, mt, h) for p, sy, sz, mt, h in rows))
+            self.db.commit()
+
+    def record(self, system, path, h, status):  # Store hashes of an installed file keyed by path, size and mtime
+        st = os.stat(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?)", (os.path.abspath(path), system, st.st_size, st.st_mtime_ns, h["crc"], h["md5"], h["sha1"], status))
+            self.db.commit()
+
+class InstalledIndex:  # Installed file base names per system, cached by directory mtime
+    def __init__(self, roms_dir):
+        self.roms_dir, self.cache, self.lock = roms_dir, {}, threading.Lock()
+        self.watched = set()  # Systems whose changes a Watcher reports through forget(); their cached entries are trusted without a stat
+
+    def basenames(self, system):  # Get base names of files in a system directory
+        system_dir = os.path.join(self.roms_dir, system)
+        if system in self.watched:
+            with self.lock:
+                hit = self.cache.get(system)
+                if hit: return hit[1]
+        try: mtime = os.stat(system_dir).st_mtime_ns
+        except OSError: return frozenset()
+        with self.lock:
+            hit = self.cache.get(system)
+            if hit and hit[0] == mtime: return hit[1]
+        names = set()
+        with os.scandir(system_dir) as it:
+            for e in it:
+                if e.is_file(): names.add(os.path.splitext(e.name)[0])
+        names = frozenset(names)
+        with self.lock: self.cache[system] = (mtime, names)
+        return names
+
+    def forget(self, system=None):  # Drop cached names for one system (or all) after a change notification
+        with self.lock:
+            if system is None: self.cache.clear()
+            else: self.cache.pop(system, None)
+
+    def is_installed(self, f): return os.path.splitext(f["name"])[0] in self.basenames(f["system"])
+
+    def add(self, system, name):  # Record a file installed by this process without rescanning
+        system_dir = os.path.join(self.roms_dir, system)
+        try: mtime = os.stat(system_dir).st_mtime_ns
+        except OSError: return
+        with self.lock:
+            hit = self.cache.get(system)
+            if hit: self.cache[system] = (mtime, hit[1] | {os.path.splitext(name)[0]})
+
+class Manifest:  # SQLite record of installed files per package; directories are rescanned only when their mtime changes
+    def __init__(self, roms_dir, path=None):
+        self.roms_dir = roms_dir
+        self.path = path or os.path.join(get_config_dir(), "installed.db")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, system TEXT, name TEXT, url TEXT, size INTEGER, installed REAL, UNIQUE (system, name));
+            CREATE TABLE IF NOT EXISTS files (system TEXT, path TEXT, package INTEGER, size INTEGER, mtime INTEGER, PRIMARY KEY (system, path));
+            CREATE INDEX IF NOT EXISTS files_package ON files (package);
+            CREATE TABLE IF NOT EXISTS dirs (system TEXT PRIMARY KEY, mtime INTEGER);
+        """)
+
+    def close(self): self.db.close()
+
+    def record(self, f, paths):  # Replace the files of an installed package in one transaction; paths are absolute
+        system_dir = os.path.join(self.roms_dir, f["system"])
+        rows = []
+        for path in paths:
+            try: st = os.stat(path)
+            except OSError: continue
+            rows.append((os.path.relpath(path, system_dir), st.st_size, st.st_mtime_ns))
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO packages (system, name) VALUES (?,?)", (f["system"], f["name"]))  # Keeps the id of a reinstalled package
+            self.db.execute("UPDATE packages SET url = ?, size = ?, installed = ? WHERE system = ? AND name = ?", (f["base"] + f["link"], f.get("size_bytes", 0), time.time(), f["system"], f["name"]))
+            pkg = self.db.execute("SELECT id FROM packages WHERE system = ? AND name = ?", (f["system"], f["name"])).fetchone()[0]
+            self.db.execute("DELETE FROM files WHERE package = ?", (pkg,))
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?)", ((f["system"], rel, pkg, size, mtime) for rel, size, mtime in rows))
+
+    def sync(self, system):  # Reconcile a system with its directory if it changed since the last look; new files are adopted
+        system_dir = os.path.join(self.roms_dir, system)
+        try: mtime = os.stat(system_dir).st_mtime_ns
+        except OSError: mtime = None
+        with self.lock:
+            row = self.db.execute("SELECT mtime FROM dirs WHERE system = ?", (system,)).fetchone()
+            if (row[0] if row else None) == mtime: return
+            present = {}
+            if mtime is not None:
+                with os.scandir(system_dir) as it: present = {e.name: e for e in it if not e.name.startswith('.')}
+            known = dict(self.db.execute("SELECT path, package FROM files WHERE system = ?", (system,)))
+            gone = [p for p in known if not (p in present if os.sep not in p else os.path.exists(os.path.join(system_dir, p)))]
+            owners = {os.path.splitext(p)[0]: known[p] for p in gone if known[p] is not None}  # Game.cue/.bin -> Game.chd keeps its package
+            added = []
+            for name, e in present.items():
+                if name in known or not e.is_file(): continue
+                st = e.stat()
+                added.append((system, name, owners.get(os.path.splitext(name)[0]), st.st_size, st.st_mtime_ns))
+            with self.db:
+                self.db.executemany("DELETE FROM files WHERE system = ? AND path = ?", ((system, p) for p in gone))
+                self.db.executemany("INSERT INTO files VALUES (?,?,?,?,?)", added)
+                if mtime is None: self.db.execute("DELETE FROM dirs WHERE system = ?", (system,))
+                else: self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?,?)", (system, mtime))
+                if gone: self.db.execute("DELETE FROM packages WHERE system = ? AND id NOT IN (SELECT package FROM files WHERE system = ? AND package IS NOT NULL)", (system, system))
+
+    def refresh(self, files):  # Update recorded size and mtime of known (system, relative path) files rewritten in place
+        rows = []
+        for system, path in files:
+            try: st = os.stat(os.path.join(self.roms_dir, system, path))
+            except OSError: continue
+            rows.append((st.st_size, st.st_mtime_ns, system, path))
+        with self.lock, self.db: self.db.executemany("UPDATE files SET size = ?, mtime = ? WHERE system = ? AND path = ?", rows)
+
+    def files(self, system):  # [(relative path, size)] of a system's installed files, sizes re-read since in-place rewrites leave the directory mtime alone
+        self.sync(system)
+        system_dir = os.path.join(self.roms_dir, system)
+        with self.lock: rows = self.db.execute("SELECT path, size, mtime FROM files WHERE system = ? ORDER BY path", (system,)).fetchall()
+        out, stale = [], []
+        for path, size, mtime in rows:
+            try: st = os.stat(os.path.join(system_dir, path))
+            except OSError: out.append((path, size)); continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime): stale.append((st.st_size, st.st_mtime_ns, system, path))
+            out.append((path, st.st_size))
+        if stale:
+            with self.lock, self.db: self.db.executemany("UPDATE files SET size = ?, mtime = ? WHERE system = ? AND path = ?", stale)
+        return out
+
+    def packages(self, system):  # {name: (id, url, size)} of packages installed for a system
+        self.sync(system)
+        with self.lock: return {n: (i, u, sz) for i, n, u, sz in self.db.execute("SELECT id, name, url, size FROM packages WHERE system = ?", (system,))}
+
+    def oldest(self):  # Install time of the least recently installed package, or None if there are none
+        with self.lock: return self.db.execute("SELECT min(installed) FROM packages").fetchone()[0]
+
+    def package_files(self, pkg):  # Absolute paths recorded for a package
+        with self.lock:
+            return [os.path.join(self.roms_dir, sy, p) for sy, p in self.db.execute("SELECT system, path FROM files WHERE package = ?", (pkg,))]
+
+    def forget(self, system, paths):  # Drop removed files (relative paths) and packages left without files
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM files WHERE system = ? AND path = ?", ((system, p) for p in paths))
+            self.db.execute("DELETE FROM packages WHERE system = ? AND id NOT IN (SELECT package FROM files WHERE system = ? AND package IS NOT NULL)", (system, system))
 
 class Manager:  # Main package manager class
     def __init__(self, cfg=None): 
         self.config_dir = get_config_dir()
         self.cfg = cfg or os.path.join(self.config_dir, "systems.json")
         self.settings = load_settings()
-        self.systems, self.files = {}, []
+        self.systems, self.files, self.delta = {}, PackageTable(), None
+        self.catalog = Catalog()
+        self.installed = InstalledIndex(self.settings["roms_dir"])
 
     def load(self):  # Load systems configuration
         try: self.systems = json.load(open(self.cfg)); return True
         except: return False
 
-    def fetch_system(self, sys_name):  # Fetch games for specific system
-        out, fmt = [], [e.lower() for e in self.systems[sys_name].get("format", [])]
+    def filter_listing(self, sys_name, lst):  # Keep ROM and archive entries for a system
+        fmt = [e.lower() for e in self.systems[sys_name].get("format", [])]
+        out = [f for f in lst if any(f["name"].lower().endswith("." + e) for e in fmt) or f["name"].lower().endswith((".zip", ".7z", ".tar.xz", ".rar"))]
+        for f in out: f["system"] = sys_name
+        return out
+
+    def mirror_bases(self, sys_name, base, health=None):  # Base URL plus its equivalents from the system's "mirrors", best first when scored
+        bases = [base, *self.systems.get(sys_name, {}).get("mirrors", {}).get(base, [])]
+        return health.rank(bases) if health and len(bases) > 1 else bases
+
+    def from_mirrors(self, sys_name, base, health, fn, nbytes=0):  # Call fn(mirror, remaining mirrors) best first until one succeeds, scoring each attempt
+        bases = self.mirror_bases(sys_name, base, health)
+        for i, mirror in enumerate(bases):
+            t = time.perf_counter()
+            try: result = fn(mirror, bases[i + 1:])
+            except StreamUnsupported: raise  # About the archive, not the mirror
+            except Exception:
+                if health: health.record(mirror, error=True)
+                if i == len(bases) - 1: raise
+                continue
+            if health: health.record(mirror, time.perf_counter() - t, nbytes)
+            return result
+
+    def fetch_system(self, sys_name, full=False, health=None):  # Fetch games for specific system
+        out = []
         for url in self.systems[sys_name].get("url", []):
-            lst = [f for f in get_directory_listing(url) if any(f["name"].lower().endswith("." + e) for e in fmt) or f["name"].lower().endswith((".zip", ".7z", ".tar.xz", ".rar"))]
-            for f in lst: f["system"] = sys_name
-            out.extend(lst)
+            out.extend(self.filter_listing(sys_name, self.from_mirrors(sys_name, url, health, lambda mirror, rest: rebase(get_directory_listing(mirror, cache=not full), mirror, url))))
         return out
 
-    def fetch(self):  # Fetch all systems with progress bar
+    async def fetch_async(self, stats, done, full=False, health=None):  # Fetch every listing URL concurrently on one event loop
+        import asyncio
+        fetcher = AsyncListingFetcher(self.settings)
+
+        async def fetch_listing(sys_name, url):  # Listing of url, failing over to its mirrors; records keep url as their base
+            bases = self.mirror_bases(sys_name, url, health)
+            for i, mirror in enumerate(bases):
+                try: lst = await fetcher.fetch(mirror, not full)
+                except Exception:
+                    if health: health.record(mirror, error=True)
+                    if i == len(bases) - 1: raise
+                    continue
+                if health: health.record(mirror)
+                return rebase(lst, mirror, url)
+
+        async def fetch_system(sys_name):
+            stats["pending"] -= 1; stats["fetching"] += 1
+            try:
+                lists = await asyncio.gather(*(fetch_listing(sys_name, url) for url in self.systems[sys_name].get("url", [])))
+                result = [f for lst in lists for f in self.filter_listing(sys_name, lst)]
+            except Exception: result = []
+            stats["fetching"] -= 1; stats["done" if result else "failed"] += 1
+            done(result)
+
+        try: await asyncio.gather(*(fetch_system(sys_name) for sys_name in self.systems))
+        finally: fetcher.close()
+
+    def fetch(self, full=False):  # Fetch all systems with progress bar
+        import asyncio
+        from urllib.request import getproxies
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from tqdm import tqdm
         if not self.load(): return
         stats = {"pending": len(self.systems), "fetching": 0, "done": 0, "failed": 0}
-        stats_lock = __import__('threading').Lock()
+        stats_lock = threading.Lock()
+        self.files = PackageTable()
+        health = MirrorHealth() if any(sy.get("mirrors") for sy in self.systems.values()) else None
         
         def fetch_with_stats(sys_name):
             with stats_lock: stats["pending"] -= 1; stats["fetching"] += 1
-            try: result = self.fetch_system(sys_name)
+            try: result = self.fetch_system(sys_name, full, health)
             except: result = []
             with stats_lock: stats["fetching"] -= 1; stats["done"] += 1 if result else 0; stats["failed"] += 1 if not result else 0
             return result
         
-        with ThreadPoolExecutor(max_workers=self.settings["fetch_workers"]) as exe:
-            futures = {exe.submit(fetch_with_stats, sys_name): sys_name for sys_name in self.systems}
-            self.files = []
-            with tqdm(total=100, desc="Fetching", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-                for fut in as_completed(futures):
-                    self.files.extend(fut.result())
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[36m↓{stats['fetching']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(self.systems)) * 100)
-                    pbar.n = progress; pbar.refresh()
+        with tqdm(total=100, desc="Fetching", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
+            def done(result):  # Merge a finished system and redraw progress
+                self.files.extend(result)
+                desc = f"\033[90m⋯{stats['pending']}\033[0m \033[36m↓{stats['fetching']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
+                pbar.set_description(desc)
+                progress = int(((stats['done'] + stats['failed']) / len(self.systems)) * 100)
+                pbar.n = progress; pbar.refresh()
+            
+            # The asyncio engine speaks plain HTTP/1.1 and does not go through proxies
+            if self.settings["fetch_engine"] == "async" and not getproxies(): asyncio.run(self.fetch_async(stats, done, full, health))
+            else:
+                with ThreadPoolExecutor(max_workers=self.settings["fetch_workers"]) as exe:
+                    futures = {exe.submit(fetch_with_stats, sys_name): sys_name for sys_name in self.systems}
+                    for fut in as_completed(futures): done(fut.result())
         
-        json.dump(self.files, open(os.path.join(self.config_dir, "packages.json"), "w"))
+        if health: health.save()
+        self.delta = self.catalog.write(self.files)
 
-    def update(self):  # Update package lists and show systems
-        self.fetch()
+    def update(self, full=False, changes=False):  # Update package lists and show systems with what changed
+        self.fetch(full)
         print("\033[1mListing systems...\033[0m")
+        totals = self.files.system_totals()
+        by_system = {}  # System -> delta rows, grouped in one pass
+        for row in self.delta or (): by_system.setdefault(row[0], []).append(row)
         for sys_name in sorted(self.systems.keys()):
-            sys_files = [f for f in self.files if f["system"] == sys_name]
-            total_size = sum(f.get("size_bytes", 0) for f in sys_files)
-            count = len(sys_files)
+            count, total_size = totals.get(sys_name, (0, 0))
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
+            delta_str = format_delta(by_system.get(sys_name, ()))
             if count > 0:
-                print(f"\033[92m✓ {size_str} {system_colored} ({count})\033[0m")
+                print(f"\033[92m✓ {size_str} {system_colored} ({count})\033[0m" + delta_str)
             else:
-                print(f"\033[91m✗ {size_str} {system_colored} ({count})\033[0m")
+                print(f"\033[91m✗ {size_str} {system_colored} ({count})\033[0m" + delta_str)
+        if changes: self.print_changes(by_system)
+
+    def print_changes(self, by_system):  # List added (+), removed (-) and resized (~) packages per system
+        if self.delta is None: print("First catalog build, no changes to show."); return
+        if not by_system: print("No catalog changes."); return
+        print("\033[1mChanges...\033[0m")
+        for sys_name in sorted(by_system.keys()):
+            print(f"\033[36m[{sys_name}]\033[0m" + format_delta(by_system[sys_name]))
+            for sy, name, change, old_size, new_size in sorted(by_system[sys_name], key=lambda r: (r[2], r[1])):
+                if change == "added": print(f"  \033[92m+\033[0m \033[33m({format_size(new_size)})\033[0m {name}")
+                elif change == "removed": print(f"  \033[91m-\033[0m \033[33m({format_size(old_size)})\033[0m {name}")
+                else: print(f"  \033[33m~ ({format_size(old_size)} → {format_size(new_size)})\033[0m {name}")
+            print()
+
+    def query(self, terms):  # Query catalog with include/keyword/-exclude/all <system> terms
+        systems = {s.lower() for s in self.systems}
+        if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in systems:
+            return self.catalog.query(system=terms[1])
+        inc = [t.lower() for t in terms if t.lower() in systems]
+        kw = [t for t in terms if t.lower() not in systems and not t.startswith('-')]
+        exc = [t[1:] for t in terms if t.startswith('-')]
+        return self.catalog.query(inc, kw, exc)
 
     def search(self, query_terms):  # Search available games
-        inc = [t.lower() for t in query_terms if t.lower() in [s.lower() for s in self.systems.keys()]]
-        kw = [t for t in query_terms if t.lower() not in [s.lower() for s in self.systems.keys()] and not t.startswith('-')]
-        exc = [t[1:] for t in query_terms if t.startswith('-')]
-        
-        if len(query_terms) == 2 and query_terms[0].lower() == "all" and query_terms[1].lower() in [s.lower() for s in self.systems.keys()]:
-            results = [f for f in self.files if f["system"].lower() == query_terms[1].lower()]
-        else: 
-            results = [f for f in self.files if (not inc or f["system"].lower() in inc) and (not kw or all(k.lower() in f["name"].lower() for k in kw)) and (not exc or not any(e.lower() in f["name"].lower() for e in exc))]
+        results = self.query(query_terms)
         
         if not results: print("No packages found."); return
         
@@ -160,44 +1451,56 @@ class Manager:  # Main package manager class
             sys_files = by_system[sys_name]
             total_size = sum(f.get("size_bytes", 0) for f in sys_files)
             count = len(sys_files)
-            installed = 0
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if os.path.exists(system_dir):
-                for f in sys_files:
-                    bn = os.path.splitext(f["name"])[0]
-                    is_installed = any(os.path.splitext(x)[0] == bn for x in os.listdir(system_dir) if os.path.isfile(os.path.join(system_dir, x)))
-                    if is_installed: installed += 1
+            names = self.installed.basenames(sys_name)
+            installed = sum(1 for f in sys_files if os.path.splitext(f["name"])[0] in names)
             
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})" + (f" ({installed} installed)" if installed > 0 else ""))
             
             for f in sys_files:
-                bn = os.path.splitext(f["name"])[0]
-                is_installed = any(os.path.splitext(x)[0] == bn for x in os.listdir(system_dir) if os.path.exists(system_dir) and os.path.isfile(os.path.join(system_dir, x)))
+                is_installed = os.path.splitext(f["name"])[0] in names
                 status = " \033[92m[installed]\033[0m" if is_installed else ""
                 size_colored = f"\033[33m({format_size(f.get('size_bytes', 0))})\033[0m"
                 print(f"  {size_colored} {f['name']}{status}")
             print()
 
+    def inspect(self, pkgs):  # {url key: members or None} for zip packages, from the catalog or read remotely from their central directories
+        if not self.settings["inspect_archives"]: return {}
+        zips = [f for f in pkgs if f["name"].lower().endswith(".zip") and "zip" not in [e.lower() for e in self.systems.get(f["system"], {}).get("format", [])]]
+        known = self.catalog.archive_members(zips)
+        todo = [f for f in zips if f["base"] + f["link"] not in known][:self.settings["inspect_max"]]
+        if not todo: return known
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def inspect_one(f):
+            try: return f, zip_members(f["base"].rstrip("/") + "/" + f["link"])
+            except (RangeNotSupported, StreamUnsupported): return f, None  # Remembered, so the archive is not asked again
+            except Exception: return None  # Transient failure: try again next time
+        
+        with ThreadPoolExecutor(max_workers=self.settings["fetch_workers"]) as exe: inspected = [r for r in exe.map(inspect_one, todo) if r]
+        self.catalog.store_members(inspected)
+        known.update((f["base"] + f["link"], members) for f, members in inspected)
+        return known
+
+    def members_installed(self, f, members):  # Whether every file inside an inspected archive is already on disk with the same size
+        if not members: return False
+        dest = os.path.join(self.settings["roms_dir"], f["system"])
+        for name, size, _ in members:
+            path = safe_member_path(dest, name)
+            try:
+                if path is None or os.path.getsize(path) != size: return False
+            except OSError: return False
+        return True
+
     def search_for_install(self, terms=None):  # Search and prepare for installation
         if terms is None: terms = input("Keywords: ").split()
-        inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in self.systems.keys()]]
-        kw = [t for t in terms if t.lower() not in [s.lower() for s in self.systems.keys()] and not t.startswith('-')]
-        exc = [t[1:] for t in terms if t.startswith('-')]
-        
-        if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in [s.lower() for s in self.systems.keys()]:
-            out = [p for p in self.files if p["system"].lower() == terms[1].lower()]
-        else:
-            out = []
-            for p in self.files:
-                system_match = not inc or p["system"].lower() in inc
-                name_match = not kw or all(k.lower() in p["name"].lower() for k in kw)
-                exclude_match = not exc or not any(e.lower() in p["name"].lower() for e in exc)
-                if system_match and name_match and exclude_match: out.append(p)
+        out = self.query(terms)
         
         if not out: print("No packages found."); return None
         
+        members = self.inspect(out)
+        is_installed = lambda f: self.installed.is_installed(f) or self.members_installed(f, members.get(f["base"] + f["link"]))
         by_system = {}
         for f in out:
             if f["system"] not in by_system: by_system[f["system"]] = []
@@ -212,97 +1515,183 @@ class Manager:  # Main package manager class
             print(f"{system_colored} {size_str} ({count})")
             
             for f in sys_files:
-                # Check if game is already installed
-                bn = os.path.splitext(f["name"])[0]
-                system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-                is_installed = False
-                if os.path.exists(system_dir):
-                    for existing_file in os.listdir(system_dir):
-                        if os.path.isfile(os.path.join(system_dir, existing_file)):
-                            existing_bn = os.path.splitext(existing_file)[0]
-                            if existing_bn == bn:
-                                is_installed = True
-                                break
-                
                 size_colored = f"\033[33m({format_size(f.get('size_bytes', 0))})\033[0m"
-                status = " \033[92m[installed]\033[0m" if is_installed else ""
+                status = " \033[92m[installed]\033[0m" if is_installed(f) else ""
                 print(f"  {size_colored} {f['name']}{status}")
             print()
         
         # Calculate total size only for packages that are not already installed
-        new_packages = []
-        for f in out:
-            bn = os.path.splitext(f["name"])[0]
-            system_dir = os.path.join(self.settings["roms_dir"], f["system"])
-            is_installed = False
-            if os.path.exists(system_dir):
-                for existing_file in os.listdir(system_dir):
-                    if os.path.isfile(os.path.join(system_dir, existing_file)):
-                        existing_bn = os.path.splitext(existing_file)[0]
-                        if existing_bn == bn:
-                            is_installed = True
-                            break
-            if not is_installed:
-                new_packages.append(f)
+        new_packages = [f for f in out if not is_installed(f)]
         
         total_size = sum(f.get("size_bytes", 0) for f in new_packages)
-        print(f"Total: {format_size(total_size)} ({len(new_packages)} packages)" + (f" ({len(out) - len(new_packages)} installed)" if len(out) > len(new_packages) else ""))
+        # Inspected archives contribute their exact unpacked size, the rest their download size
+        unpacked = [sum(m[1] for m in members[f["base"] + f["link"]]) if members.get(f["base"] + f["link"]) else f.get("size_bytes", 0) for f in new_packages]
+        exact = any(members.get(f["base"] + f["link"]) for f in new_packages)
+        print(f"Total: {format_size(total_size)} ({len(new_packages)} packages)" + (f", {format_size(sum(unpacked))} unpacked" if exact else "") + (f" ({len(out) - len(new_packages)} installed)" if len(out) > len(new_packages) else ""))
         return out
 
-    def install(self, pkgs):  # Install packages with progress bar
-        from threading import Lock
-        stats = {"pending": len(pkgs), "downloading": 0, "extracting": 0, "done": 0, "failed": 0}
-        stats_lock = Lock()
+    def install(self, pkgs, reinstall=False):  # Install packages through download and extraction stages; returns per-package results
+        import multiprocessing
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        from tqdm import tqdm
+        stats = {"pending": len(pkgs), "downloading": 0, "extracting": 0, "compressing": 0, "done": 0, "failed": 0}
+        stats_lock, space, finished = threading.Lock(), threading.Condition(), queue.Queue()
+        installed = {}
+        for sys_name in set(pkg["system"] for pkg in pkgs):
+            with span("installed_scan", sys_name): installed[sys_name] = set(self.installed.basenames(sys_name))
+        members = self.inspect(pkgs)  # Normally cached by search_for_install
+        metrics, begun = get_metrics(), {}  # Per-package start times, kept only while metrics are on
+        slots = threading.BoundedSemaphore(self.settings["extract_queue"])  # Downloaded archives waiting for or in extraction
+        min_free = self.settings["tmp_min_free_mb"] * 1024**2
+        if self.settings["extract_processes"]:
+            extract_pool = ProcessPoolExecutor(max_workers=self.settings["extract_workers"], mp_context=multiprocessing.get_context("spawn"))
+        else: extract_pool = ThreadPoolExecutor(max_workers=self.settings["extract_workers"])
+        verify, bad = self.settings["verify_downloads"], []
+        # Disc images of opted-in systems go through a bounded chdman stage while later downloads continue
+        compress_systems, unconverted = set(self.settings["compress_on_install"]) & set(installed), []
+        if compress_systems:
+            converter, cores = Converter(), os.cpu_count() or 1
+            convert_workers = max(1, min(self.settings["compress_workers"] or cores, cores))
+            convert_pool, convert_slots = ThreadPoolExecutor(max_workers=convert_workers), threading.BoundedSemaphore(convert_workers * 2)
+        hashdb = HashDB() if verify else None
+        manifest = Manifest(self.settings["roms_dir"])
+        health, probes = None, {}  # Mirror scores, refreshed by probing stale mirrors with a sample package before downloads start
+        if any(sy.get("mirrors") for sy in self.systems.values()):
+            health, interval = MirrorHealth(), self.settings["mirror_probe_interval"]
+            for f in pkgs:
+                bases = self.mirror_bases(f["system"], f["base"])
+                if len(bases) < 2 or not interval: continue
+                for base in bases:
+                    if base not in probes and health.stale(base, interval): probes[base] = base.rstrip("/") + "/" + f["link"]
+            if probes: health.probe(probes, min(10, self.settings["http_timeout"]))
+        for sys_name in (installed if verify else ()):
+            for source in self.systems[sys_name].get("dat", []):
+                try: hashdb.load_dat(sys_name, source)
+                except Exception as e: print(f"W: Could not load DAT {source}: {e}")
         
-        def worker(f):
-            dest, tmp = os.path.join(self.settings["roms_dir"], f["system"]), os.path.join(self.settings["roms_dir"], f["system"], "tmp")
-            os.makedirs(dest, exist_ok=True); os.makedirs(tmp, exist_ok=True)
-            
-            # Check if exact file already exists
-            if os.path.exists(os.path.join(dest, f["name"])): 
-                with stats_lock: stats["pending"] -= 1; stats["done"] += 1
-                return ("skipped", f)
-                
-            # Check if game with same base name already exists (without extension)
-            bn = os.path.splitext(f["name"])[0]
-            if os.path.exists(dest):
-                for existing_file in os.listdir(dest):
-                    if os.path.isfile(os.path.join(dest, existing_file)):
-                        existing_bn = os.path.splitext(existing_file)[0]
-                        if existing_bn == bn:
-                            with stats_lock: stats["pending"] -= 1; stats["done"] += 1
-                            return ("skipped", f)
-            
-            tmp_path = os.path.join(tmp, f["name"])
-            url = f["base"].rstrip("/") + "/" + f["link"]
+        def check(f, files):  # Verify installed files against the system's DATs and remember their hashes
+            for path, h in (files or {}).items():
+                if not h: continue
+                status = hashdb.verify(f["system"], path, h)
+                hashdb.record(f["system"], path, h, status)
+                if status == "bad":
+                    with stats_lock: bad.append((f["system"], os.path.basename(path)))
+        
+        def compress(f, stage, images, queued, files):  # Compression stage: convert a package's disc images to CHD
+            if metrics: metrics.record("compress_wait", f["name"], time.perf_counter() - queued)
             try:
-                with stats_lock: stats["pending"] -= 1; stats["downloading"] += 1
-                download_file(url, tmp_path)
-                with stats_lock: stats["downloading"] -= 1; stats["extracting"] += 1
+                for path in images:
+                    try:
+                        job = converter.job(path, f["system"], remove_bins=True)
+                        ok = converter.convert_job(job, max(1, cores // convert_workers))
+                    except Exception: ok = False
+                    if ok: files = [p for p in files if p != path and p not in job.cleanup] + [converter._output(path, job.mode)]
+                    else:
+                        with stats_lock: unconverted.append((f["system"], os.path.basename(path)))
+            finally: convert_slots.release()
+            finish(f, "done", stage, files=files)
+        
+        def complete(f, status, stage=None, error=None, files=None):  # Record the result of a package, handing disc images to the compression stage
+            if files and hashdb:
+                try: check(f, files)
+                except Exception as e: print(f"W: Could not verify {f['name']}: {e}")
+            images = [p for p in (files or {}) if os.path.splitext(p)[1].lower() in (".iso", ".cue", ".gdi")] if status == "done" and f["system"] in compress_systems else []
+            if images:
+                queued = time.perf_counter()
+                convert_slots.acquire()  # Blocks the handing-off worker while the conversion queue is full
+                with stats_lock:
+                    if stage: stats[stage] -= 1
+                    stats["compressing"] += 1
+                try: convert_pool.submit(compress, f, "compressing", images, queued, list(files))
+                except BaseException: convert_slots.release(); raise
+                return
+            finish(f, status, stage, error, files)
+        
+        def finish(f, status, stage=None, error=None, files=None):  # Record the final result of a package and the files it installed
+            with stats_lock:
+                if stage: stats[stage] -= 1
+                stats["failed" if status == "error" else "done"] += 1
+                if status == "done": installed[f["system"]].add(os.path.splitext(f["name"])[0])
+            if status == "done":
+                self.installed.add(f["system"], f["name"])
+                try: manifest.record(f, files or ())
+                except Exception as e: print(f"W: Could not record {f['name']} in the manifest: {e}")
+            if metrics and (f["system"], f["name"]) in begun:
+                metrics.record("install", f["name"], time.perf_counter() - begun.pop((f["system"], f["name"])), f.get("size_bytes", 0), status == "error", status=status)
+            finished.put((status, f) if error is None else (status, f, error))
+        
+        def extracted(fut, f, queued):  # Extraction stage callback
+            slots.release()
+            with space: space.notify_all()
+            try: files, started, seconds = fut.result()
+            except Exception as e: return complete(f, "error", "extracting", str(e))
+            if metrics:  # Timed in the extraction worker, which may be another process
+                metrics.record("extract_wait", f["name"], max(0, started - queued))
+                metrics.record("extract", f["name"], seconds, sum(os.path.getsize(p) for p in files if os.path.isfile(p)))
+            complete(f, "done", "extracting", files=files)
+        
+        def has_space(tmp, size):  # Tmp backpressure: wait for extractions to free space unless none are in flight
+            return stats["extracting"] == 0 or shutil.disk_usage(tmp).free - size >= min_free
+        
+        def download(f, submitted):  # Download stage
+            stage = None
+            if metrics:
+                begun[(f["system"], f["name"])] = time.perf_counter()
+                metrics.record("queue", f["name"], begun[(f["system"], f["name"])] - submitted)
+            try:
+                dest, tmp = os.path.join(self.settings["roms_dir"], f["system"]), os.path.join(self.settings["roms_dir"], f["system"], "tmp")
+                os.makedirs(dest, exist_ok=True); os.makedirs(tmp, exist_ok=True)
                 
-                ext = "tar.xz" if f["name"].endswith(".tar.xz") else os.path.splitext(f["name"])[1].lstrip(".").lower()
-                if ext in [e.lower() for e in self.systems[f["system"]].get("format", [])]:
-                    shutil.move(tmp_path, os.path.join(dest, f["name"]))
-                else: 
-                    extract_archive(tmp_path, dest, ext); os.remove(tmp_path)
+                # Check if exact file or game with same base name already exists
+                if not reinstall and (os.path.exists(os.path.join(dest, f["name"])) or os.path.splitext(f["name"])[0] in installed[f["system"]] or self.members_installed(f, members.get(f["base"] + f["link"]))):
+                    with stats_lock: stats["pending"] -= 1
+                    return complete(f, "skipped")
                 
-                with stats_lock: stats["extracting"] -= 1; stats["done"] += 1
-                return ("done", f)
-            except Exception as e: 
-                with stats_lock: stats["downloading"] = max(0, stats["downloading"] - 1); stats["extracting"] = max(0, stats["extracting"] - 1); stats["failed"] += 1
-                return ("error", f, str(e))
+                tmp_path = os.path.join(tmp, f["name"])
+                link = lambda base: base.rstrip("/") + "/" + f["link"]
+                split = lambda mirror, rest: [link(b) for b in health.split(mirror, rest)] if health and self.settings["mirror_split"] else []
+                ext = "tar.xz" if f["name"].endswith(".tar.xz") else os.path.splitext(f["name"])[1].lstrip(".").lower()
+                is_rom = ext in [e.lower() for e in self.systems[f["system"]].get("format", [])]
+                # Small zip/tar.xz archives unpack while downloading; large ones keep the resumable segmented temp-file path
+                streamable = not is_rom and ext in ("zip", "tar.xz") and self.settings["stream_extract"] and not os.path.exists(tmp_path + ".part") and (self.settings["segments"] <= 1 or f.get("size_bytes", 0) < self.settings["segment_threshold_mb"] * 1024**2)
+                with stats_lock: stats["pending"] -= 1; stats["downloading"] += 1
+                stage, files = "downloading", None
+                try:
+                    if streamable: files = self.from_mirrors(f["system"], f["base"], health, lambda mirror, rest: stream_extract(link(mirror), dest, ext, verify), f.get("size_bytes", 0))
+                except StreamUnsupported: streamable = False
+                if not streamable:
+                    waited = time.perf_counter()
+                    with space:
+                        while not has_space(tmp, f.get("size_bytes", 0)): space.wait(5)
+                    if metrics: metrics.record("space_wait", f["name"], time.perf_counter() - waited)
+                    hashes = self.from_mirrors(f["system"], f["base"], health, lambda mirror, rest: download_file(link(mirror), tmp_path, verify, split(mirror, rest), link(f["base"])), f.get("size_bytes", 0))
+                    if is_rom: shutil.move(tmp_path, os.path.join(dest, f["name"])); files = {os.path.join(dest, f["name"]): hashes}
+                    else:
+                        queued = time.time()  # Wall clock, comparable with the extraction worker's start time
+                        slots.acquire()  # Blocks this download worker while the extraction queue is full
+                        with stats_lock: stats["downloading"] -= 1; stats["extracting"] += 1
+                        stage = "extracting"
+                        try: extract_pool.submit(extract_and_remove, tmp_path, dest, ext, verify).add_done_callback(lambda fut: extracted(fut, f, queued))
+                        except BaseException: slots.release(); raise
+                        return
+                complete(f, "done", stage, files=files)
+            except Exception as e: complete(f, "error", stage, str(e))
         
+        results = []
         with tqdm(total=100, desc="Installing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
             with ThreadPoolExecutor(max_workers=self.settings["install_workers"]) as exe:
-                futures = {exe.submit(worker, pkg): pkg for pkg in pkgs}
-                results = []
-                for fut in as_completed(futures): 
-                    result = fut.result()
-                    results.append(result)
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m↓{stats['downloading']}\033[0m \033[36m⚙{stats['extracting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
+                for pkg in order_packages(pkgs, self.settings["install_order"]): exe.submit(download, pkg, time.perf_counter())
+                for _ in pkgs:
+                    results.append(finished.get())
+                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m↓{stats['downloading']}\033[0m \033[36m⚙{stats['extracting']}\033[0m " + (f"\033[35m◆{stats['compressing']}\033[0m " if compress_systems else "") + f"\033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
                     pbar.set_description(desc)
                     progress = int(((stats['done'] + stats['failed']) / len(pkgs)) * 100)
                     pbar.n = progress; pbar.refresh()
+        extract_pool.shutdown()
+        if compress_systems: convert_pool.shutdown()
+        if hashdb: hashdb.close()
+        if health: health.save()
+        manifest.close()
         
         for sys_name in set(pkg["system"] for pkg in pkgs):
             tmp_dir = os.path.join(self.settings["roms_dir"], sys_name, "tmp")
@@ -317,38 +1706,35 @@ class Manager:  # Main package manager class
             print(f"\033[92m✓ {installed_count}\033[0m installed, \033[93m⏭ {skipped_count}\033[0m skipped (installed), \033[91m✗ {failed_count}\033[0m failed")
         else:
             print(f"\033[92m✓ {installed_count}\033[0m installed, \033[91m✗ {failed_count}\033[0m failed")
+        if bad:
+            print(f"\033[93m⚠ {len(bad)}\033[0m files do not match their DAT:")
+            for sys_name, name in sorted(bad): print(f"  \033[36m[{sys_name}]\033[0m {name}")
+        if unconverted:
+            print(f"\033[93m⚠ {len(unconverted)}\033[0m images could not be compressed (run 'retro compress' to retry):")
+            for sys_name, name in sorted(unconverted): print(f"  \033[36m[{sys_name}]\033[0m {name}")
+        return results
 
     def list(self):  # List installed games by system
         try: self.systems = json.load(open(self.cfg))
         except Exception as e: print(f"E: Error loading systems.json: {e}"); return
         
-        all_files = []
-        for sys_name in self.systems:
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if not os.path.exists(system_dir): continue
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append({"name": file, "path": file_path, "system": sys_name})
-        
-        if not all_files: print("No games installed."); return
-        
-        by_system = {}
-        for f in all_files:
-            if f["system"] not in by_system: by_system[f["system"]] = []
-            by_system[f["system"]].append(f)
+        manifest = Manifest(self.settings["roms_dir"])
+        try: by_system = {sys_name: manifest.files(sys_name) for sys_name in self.systems}
+        finally: manifest.close()
+        by_system = {sys_name: files for sys_name, files in by_system.items() if files}
+        if not by_system: print("No games installed."); return
         
         for sys_name in sorted(by_system.keys()):
             sys_files = by_system[sys_name]
-            total_size = sum(os.path.getsize(f['path']) for f in sys_files)
+            total_size = sum(size for name, size in sys_files)
             count = len(sys_files)
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})")
             
-            for f in sys_files:
-                size_colored = f"\033[33m({format_size(os.path.getsize(f['path']))})\033[0m"
-                print(f"  {size_colored} {f['name']}")
+            for name, size in sys_files:
+                size_colored = f"\033[33m({format_size(size)})\033[0m"
+                print(f"  {size_colored} {name}")
             print()
 
     def uninstall(self, terms=None):  # Remove games with confirmation
@@ -356,14 +1742,10 @@ class Manager:  # Main package manager class
         try: self.systems = json.load(open(self.cfg))
         except Exception as e: print(f"E: Error loading systems.json: {e}"); return
         
-        all_files = []
-        for sys_name in self.systems:
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if not os.path.exists(system_dir): continue
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append({"name": file, "path": file_path, "system": sys_name})
+        manifest = Manifest(self.settings["roms_dir"])
+        try: all_files = [{"name": name, "path": os.path.join(self.settings["roms_dir"], sys_name, name), "system": sys_name, "size": size}
+                          for sys_name in self.systems for name, size in manifest.files(sys_name)]
+        finally: manifest.close()
         
         if not all_files: print("No games installed."); return
         
@@ -390,76 +1772,207 @@ class Manager:  # Main package manager class
         
         for sys_name in sorted(by_system.keys()):
             sys_files = by_system[sys_name]
-            total_size = sum(os.path.getsize(f['path']) for f in sys_files)
+            total_size = sum(f['size'] for f in sys_files)
             count = len(sys_files)
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})")
             
             for f in sys_files:
-                size_colored = f"\033[33m({format_size(os.path.getsize(f['path']))})\033[0m"
+                size_colored = f"\033[33m({format_size(f['size'])})\033[0m"
                 print(f"  {size_colored} {f['name']}")
             print()
         
-        total_size = sum(os.path.getsize(f['path']) for f in out)
+        total_size = sum(f['size'] for f in out)
         print(f"Total: {format_size(total_size)} ({len(out)} games)")
         
         confirm = input("Do you want to continue? [Y/n] ")
         if confirm.lower() in ["y", "yes", ""]:
-            for f in out: os.remove(f['path'])
+            for f in out:
+                try: os.remove(f['path'])
+                except FileNotFoundError: pass  # Already gone; drop it from the manifest anyway
+            manifest = Manifest(self.settings["roms_dir"])
+            try:
+                for sys_name in by_system: manifest.forget(sys_name, [f['name'] for f in by_system[sys_name]])
+            finally: manifest.close()
             print(f"\033[92m✓ {len(out)}\033[0m games removed")
         else: print("Abort.")
 
+    def upgrade(self):  # Reinstall packages whose catalog entry changed since they were installed
+        if not self.load(): print("E: Could not load systems.json"); return
+        if not self.catalog.exists(): print("E: No package data found. Run 'retro update' first."); return
+        changed, missing, old_files = [], [], {}
+        manifest = Manifest(self.settings["roms_dir"])
+        try:
+            since = manifest.oldest()
+            delta = self.catalog.changes(since) if since is not None else None
+            touched = None if delta is None else {(sy, n) for sy, n, change, old_size, new_size in delta if change != "added"}  # Only these can differ
+            for sys_name in self.systems:
+                installed = manifest.packages(sys_name)
+                if touched is not None: installed = {n: v for n, v in installed.items() if (sys_name, n) in touched}
+                if not installed: continue
+                current = {f["name"]: f for f in self.catalog.query(system=sys_name)}
+                for name, (pkg, url, size) in installed.items():
+                    f = current.get(name)
+                    if f is None: missing.append((sys_name, name))
+                    elif f["size_bytes"] != size:
+                        changed.append((f, size)); old_files[(sys_name, name)] = manifest.package_files(pkg)
+        finally: manifest.close()
+        
+        if missing:
+            print(f"\033[93m⚠ {len(missing)}\033[0m installed packages are no longer in the catalog:")
+            for sys_name, name in sorted(missing): print(f"  \033[36m[{sys_name}]\033[0m {name}")
+        if not changed: print("All installed packages are up to date."); return
+        
+        print("The following packages will be upgraded:")
+        by_system = {}
+        for f, size in changed: by_system.setdefault(f["system"], []).append((f, size))
+        for sys_name in sorted(by_system.keys()):
+            print(f"\033[36m[{sys_name}]\033[0m ({len(by_system[sys_name])})")
+            for f, size in by_system[sys_name]: print(f"  \033[33m({format_size(size)} → {format_size(f['size_bytes'])})\033[0m {f['name']}")
+            print()
+        print(f"Total: {format_size(sum(f['size_bytes'] for f, size in changed))} ({len(changed)} packages)")
+        
+        confirm = input("Do you want to continue? [Y/n] ")
+        if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
+        results = self.install([f for f, size in changed], reinstall=True)
+        
+        manifest = Manifest(self.settings["roms_dir"])  # Remove files the old versions had that the new ones do not
+        try:
+            for r in results:
+                if r[0] != "done": continue
+                pkg = manifest.packages(r[1]["system"]).get(r[1]["name"])
+                current = set(manifest.package_files(pkg[0])) if pkg else set()
+                for path in old_files[(r[1]["system"], r[1]["name"])]:
+                    if path not in current and os.path.isfile(path): os.remove(path)
+        finally: manifest.close()
+
+ConvertJob = namedtuple("ConvertJob", "mode path system size cleanup")  # Immutable conversion job; cleanup lists files removed after success
+
+def track_files(path):  # Data files referenced by a CUE or GDI sheet that exist next to it
+    names, base = [], os.path.dirname(path)
+    try:
+        with open(path, errors='ignore') as f:
+            if path.lower().endswith(".cue"): names = re.findall(r'^\s*FILE\s+"?(.+?)"?\s+\w+\s*$', f.read(), re.M)
+            else: names = [m[0] or m[1] for m in re.findall(r'^\s*\d+\s+\d+\s+\d+\s+\d+\s+(?:"([^"]+)"|(\S+))', f.read(), re.M)]
+    except OSError: pass
+    return [p for p in (os.path.join(base, n) for n in names) if os.path.isfile(p)]
+
 class Converter:  # CHD conversion utilities
     def __init__(self, mode="chd_to_iso"): 
         self.mode = mode
         self.settings = load_settings()
 
+    def journal(self, command, root):  # Journal path for one command over one folder, so runs only ever resume their own jobs
+        key = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(get_config_dir(), f"{command}-{key}.journal")
+
+    def job(self, f, system=None, remove_bins=False):  # Conversion job for one ISO/CUE/GDI image
+        mode = os.path.splitext(f)[1].lower().lstrip(".") + "_to_chd"
+        tracks = track_files(f) if mode != "iso_to_chd" else []
+        cleanup = ()
+        if remove_bins and mode == "cue_to_chd":
+            dir_name, file_base = os.path.dirname(f), os.path.splitext(os.path.basename(f))[0]
+            cleanup = tuple(glob(os.path.join(dir_name, f"{file_base}.bin")) or glob(os.path.join(dir_name, f"{file_base}*.bin")))
+        return ConvertJob(mode, f, system, sum(os.path.getsize(x) for x in {f, *tracks, *cleanup}), cleanup)
+
+    def _jobs(self, folder, system=None, remove_bins=False):  # Conversion jobs for disc images in a folder
+        return [self.job(f, system, remove_bins) for ext in ("*.iso", "*.cue", "*.gdi") for f in glob(os.path.join(folder, ext))]
+
+    def convert_job(self, job, threads=None):  # Convert one job and remove its cleanup files on success
+        if not self._convert(job.path, job.mode, threads): return False
+        for f in job.cleanup:
+            if os.path.exists(f): os.remove(f)
+        return True
+
+    def _resume(self, journal_path):  # Unfinished jobs from an interrupted run, per its journal
+        jobs, finished = {}, set()
+        try:
+            with open(journal_path) as f:
+                for line in f:
+                    try: entry = json.loads(line)
+                    except ValueError: continue  # Torn last line
+                    if "state" in entry: finished.add(entry["path"])
+                    else: jobs[entry["path"]] = ConvertJob(entry["mode"], entry["path"], entry["system"], entry["size"], tuple(entry["cleanup"]))
+        except OSError: return []
+        jobs = [j for p, j in jobs.items() if p not in finished and (os.path.exists(p) or os.path.exists(self._output(p, j.mode)))]
+        if not jobs: os.remove(journal_path)
+        return jobs
+
+    def run(self, jobs, label, workers, journal_path):  # Run jobs largest-first, splitting the CPU cores between running chdman processes
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from tqdm import tqdm
+        jobs = sorted(jobs, key=lambda j: -j.size)
+        cores = os.cpu_count() or 1
+        workers = max(1, min(workers or cores, cores, len(jobs)))
+        stats = {"pending": len(jobs), "running": 0, "done": 0, "failed": 0}
+        stats_lock = threading.Lock()
+        
+        with open(journal_path, 'a') as journal:
+            def log(entry):
+                with stats_lock: journal.write(json.dumps(entry) + "\n"); journal.flush()
+            for job in jobs: log(job._asdict())
+            
+            def worker(job):
+                with stats_lock:
+                    stats["pending"] -= 1; stats["running"] += 1
+                    # Share cores among the jobs still left, so the tail of the queue gets more threads each
+                    threads = max(1, cores // min(workers, stats["pending"] + stats["running"]))
+                ok = False
+                try:
+                    # An interrupted run may have converted the image but not removed its tracks yet
+                    if os.path.exists(job.path): ok = self.convert_job(job, threads)
+                    elif os.path.exists(self._output(job.path, job.mode)):
+                        for f in job.cleanup:
+                            if os.path.exists(f): os.remove(f)
+                        ok = True
+                except: ok = False
+                log({"path": job.path, "state": "done" if ok else "failed"})
+                with stats_lock: stats["running"] -= 1; stats["done" if ok else "failed"] += 1
+            
+            with tqdm(total=100, desc=label, bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
+                with ThreadPoolExecutor(max_workers=workers) as exe:
+                    futures = [exe.submit(worker, job) for job in jobs]
+                    for fut in as_completed(futures):
+                        desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['running']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
+                        pbar.set_description(desc)
+                        progress = int(((stats['done'] + stats['failed']) / len(jobs)) * 100)
+                        pbar.n = progress; pbar.refresh()
+        os.remove(journal_path)
+        return stats
+
     def convert_all(self, folder="."):  # Convert all files in folder
-        files = []
-        for ext, mode in [("*.iso", "iso_to_chd"), ("*.cue", "cue_to_chd"), ("*.gdi", "gdi_to_chd")]:
-            files.extend([(mode, f) for f in glob(os.path.join(folder, ext))])
+        journal = self.journal("convert", folder)
+        files = self._resume(journal)
+        if files: print(f"Resuming {len(files)} interrupted conversions.")
+        else: files = self._jobs(folder)
         
         if not files: print("No files to convert."); return
         
-        stats = {"pending": len(files), "converting": 0, "done": 0, "failed": 0}
-        stats_lock = __import__('threading').Lock()
-        
-        def convert_worker(mode, file_path):
-            with stats_lock: stats["pending"] -= 1; stats["converting"] += 1
-            try:
-                self.mode = mode
-                if self._convert(file_path):
-                    with stats_lock: stats["converting"] -= 1; stats["done"] += 1
-                else:
-                    with stats_lock: stats["converting"] -= 1; stats["failed"] += 1
-            except:
-                with stats_lock: stats["converting"] -= 1; stats["failed"] += 1
-        
-        with tqdm(total=100, desc="Converting", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-            with ThreadPoolExecutor(max_workers=self.settings["convert_workers"]) as exe:
-                futures = {exe.submit(convert_worker, mode, file_path): (mode, file_path) for mode, file_path in files}
-                for fut in as_completed(futures):
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['converting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(files)) * 100)
-                    pbar.n = progress; pbar.refresh()
-        
+        stats = self.run(files, "Converting", self.settings["convert_workers"], journal)
         print(f"\033[92m✓ {stats['done']}\033[0m converted, \033[91m✗ {stats['failed']}\033[0m failed")
 
-    def _convert(self, f):  # Convert single file using chdman
-        f = os.path.normpath(f)
-        b = os.path.splitext(f)[0]
+    def _output(self, f, mode):  # Output path for a conversion
         ext_map = {"chd_to_iso": ".iso", "chd_to_cue": ".cue", "chd_to_gdi": ".gdi"}
-        out = b + (".chd" if "to_chd" in self.mode else ext_map.get(self.mode, ""))
+        return os.path.splitext(os.path.normpath(f))[0] + (".chd" if "to_chd" in mode else ext_map.get(mode, ""))
+
+    def _convert(self, f, mode=None, threads=None):  # Convert single file using chdman
+        import subprocess
+        mode = mode or self.mode
+        f = os.path.normpath(f)
+        out = self._output(f, mode)
         
         if not os.path.exists(f): print(f"Error: Input file not found: {f}"); return False
         
         f_abs, out_abs = os.path.abspath(f), os.path.abspath(out)
-        cmd = ["chdman", "createcd" if "to_chd" in self.mode else "extractcd", "-i", f_abs, "-o", out_abs, "-f"]
+        cmd = ["chdman", "createcd" if "to_chd" in mode else "extractcd", "-i", f_abs, "-o", out_abs, "-f"]
+        if threads and "to_chd" in mode: cmd += ["-np", str(threads)]
         
         try:
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, cwd=os.path.dirname(f_abs) or '.')
+            with span("convert", f_abs) as s:
+                s.bytes = os.path.getsize(f_abs)
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, cwd=os.path.dirname(f_abs) or '.')
+                s.fields = {"mode": mode, "threads": threads, "returncode": result.returncode}
             if result.returncode != 0:
                 stderr = result.stderr.decode('utf-8', errors='ignore').strip()
                 if stderr: print(f"Error converting {os.path.basename(f)}: {stderr[:100]}")
@@ -472,69 +1985,77 @@ class Converter:  # CHD conversion utilities
         except Exception as e: print(f"Error: {e}"); return False
 
     def auto_compress_all(self):  # Compress ROMs to CHD with preview
-        total_files = []
-        for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
-            system = os.path.basename(system_dir)
-            for ext, mode in [("*.iso", "iso_to_chd"), ("*.cue", "cue_to_chd"), ("*.gdi", "gdi_to_chd")]:
-                total_files.extend([(mode, f, system) for f in glob(os.path.join(system_dir, ext))])
-        
-        if not total_files: print("No files to compress."); return
-        
-        print(f"The following files will be compressed:")
-        for mode, file_path, system in total_files:
-            system_colored = f"\033[36m[{system}]\033[0m"
-            size_colored = f"\033[33m({format_size(os.path.getsize(file_path))})\033[0m"
-            base_name = os.path.basename(file_path)
-            chd_name = os.path.splitext(base_name)[0] + ".chd"
+        journal = self.journal("compress", self.settings["roms_dir"])
+        total_files = self._resume(journal)
+        if total_files: print(f"Resuming {len(total_files)} interrupted conversions.")
+        else:
+            for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
+                total_files.extend(self._jobs(system_dir, os.path.basename(system_dir), remove_bins=True))
             
-            print(f"  {system_colored} {size_colored} {base_name}")
-            print(f"    \033[92m→ Create:\033[0m {chd_name}")
-            print(f"    \033[91m→ Delete:\033[0m {base_name}")
+            if not total_files: print("No files to compress."); return
             
-            if mode == "cue_to_chd":
-                dir_name = os.path.dirname(file_path)
-                file_base = os.path.splitext(base_name)[0]
-                bin_files = glob(os.path.join(dir_name, f"{file_base}.bin")) or glob(os.path.join(dir_name, f"{file_base}*.bin"))
-                for bin_file in bin_files:
+            print(f"The following files will be compressed:")
+            for job in sorted(total_files, key=lambda j: -j.size):
+                system_colored = f"\033[36m[{job.system}]\033[0m"
+                size_colored = f"\033[33m({format_size(job.size)})\033[0m"
+                base_name = os.path.basename(job.path)
+                chd_name = os.path.splitext(base_name)[0] + ".chd"
+                
+                print(f"  {system_colored} {size_colored} {base_name}")
+                print(f"    \033[92m→ Create:\033[0m {chd_name}")
+                print(f"    \033[91m→ Delete:\033[0m {base_name}")
+                for bin_file in job.cleanup:
                     print(f"    \033[91m→ Delete:\033[0m {os.path.basename(bin_file)}")
+            
+            confirm = input("Do you want to continue? [Y/n] ")
+            if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
         
-        confirm = input("Do you want to continue? [Y/n] ")
-        if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
-        
-        stats = {"pending": len(total_files), "compressing": 0, "done": 0, "failed": 0}
-        stats_lock = __import__('threading').Lock()
-        
-        def compress_worker(mode, file_path, system):
-            with stats_lock: stats["pending"] -= 1; stats["compressing"] += 1
-            try:
-                self.mode = mode
-                if self._convert(file_path):
-                    if mode == "cue_to_chd":
-                        dir_name = os.path.dirname(file_path)
-                        file_base = os.path.splitext(os.path.basename(file_path))[0]
-                        bin_files = glob(os.path.join(dir_name, f"{file_base}.bin")) or glob(os.path.join(dir_name, f"{file_base}*.bin"))
-                        for bin_file in bin_files: os.remove(bin_file)
-                    with stats_lock: stats["compressing"] -= 1; stats["done"] += 1
-                else:
-                    with stats_lock: stats["compressing"] -= 1; stats["failed"] += 1
-            except:
-                with stats_lock: stats["compressing"] -= 1; stats["failed"] += 1
-        
-        with tqdm(total=100, desc="Compressing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-            with ThreadPoolExecutor(max_workers=self.settings["compress_workers"]) as exe:
-                futures = {exe.submit(compress_worker, mode, file_path, system): (mode, file_path, system) for mode, file_path, system in total_files}
-                for fut in as_completed(futures):
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['compressing']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(total_files)) * 100)
-                    pbar.n = progress; pbar.refresh()
-        
+        stats = self.run(total_files, "Compressing", self.settings["compress_workers"], journal)
         print(f"\033[92m✓ {stats['done']}\033[0m compressed, \033[91m✗ {stats['failed']}\033[0m failed")
 
+TAG_RE = re.compile(r'[\[\(]([^\]\)]+)[\]\)]')  # Tag contents inside brackets/parentheses
+BRACKET_RE = re.compile(r'[\[\(].*?[\]\)]')  # Whole bracketed/parenthesized tags
+REGION_TAGS = frozenset(['W', 'E', 'U', 'J', 'USA', 'EUR', 'JPN', 'PAL', 'NTSC'])
+PURITY_TAGS = {'final': 5, 'complete': 5, 'full': 5, 'demo': -20, 'beta': -20, 'alpha': -20, 'prototype': -20, 'hack': -10, 'mod': -10, 'patch': -10}
+
+TAG_INFO = {}  # Tag -> (region, purity, field, value); tags repeat across a set, so each is interpreted once
+
+def tag_info(tag):  # Meaning of a single tag: region it names, purity delta and disc/version/rev field it sets
+    info = TAG_INFO.get(tag)
+    if info is None:
+        upper, lower = tag.upper(), tag.lower()
+        region = upper if upper in REGION_TAGS else None
+        purity = 10 if region else PURITY_TAGS.get(lower, 0)
+        if lower.startswith('disc'): field, value = 0, int(tag[4:]) if tag[4:].isdigit() else 1
+        elif lower.startswith('v'): field, value = 1, int(tag[1:]) if tag[1:].isdigit() else 1
+        elif lower.startswith('rev'): field, value = 2, int(tag[3:]) if tag[3:].isdigit() else 1
+        else: field, value = None, None
+        info = TAG_INFO[tag] = (region, purity, field, value)
+    return info
+
+class RomName:  # Filename parsed in one pass: title, region tags, disc/version/rev and purity score
+    __slots__ = ('title', 'regions', 'disc', 'version', 'rev', 'purity')
+
+    def __init__(self, filename):
+        self.title = BRACKET_RE.sub('', filename).strip()
+        regions, numbers, purity = [], [1, 1, 1], 0
+        for tag in TAG_RE.findall(filename):
+            region, score, field, value = TAG_INFO.get(tag) or tag_info(tag)
+            if region: regions.append(region)
+            if field is not None: numbers[field] = value
+            purity += score
+        self.regions, self.purity = tuple(regions), purity
+        self.disc, self.version, self.rev = numbers
+
+    def rank(self, rank_table):  # Sort key, lower is better; the first region tag counts, 'U' if there is none
+        return (rank_table.get(self.regions[0] if self.regions else 'U', 999), self.disc, self.version, self.rev, -self.purity)
+
 class RomCleaner:  # Duplicate ROM detection and removal
     def __init__(self, regions="W,E,U,J"): 
         self.regions = regions.split(",")
         self.settings = load_settings()
+        self.rank_table = self._build_rank_table(self.regions)
+        self.names = {}
 
     def _build_rank_table(self, user_regions):  # Build region priority table
         rank_table = {}
@@ -542,81 +2063,42 @@ class RomCleaner:  # Duplicate ROM detection and removal
             rank_table[region] = i
         return rank_table
 
-    def _clean_name(self, filename): return re.sub(r'[\[\(].*?[\]\)]', '', filename).strip()  # Remove brackets/parentheses
-
-    def _extract_tags(self, filename): return re.findall(r'[\[\(]([^\]\)]+)[\]\)]', filename)  # Extract tags from filename
-
-    def _get_region(self, tags):  # Determine region from tags
-        for tag in tags:
-            if tag.upper() in ['W', 'E', 'U', 'J', 'USA', 'EUR', 'JPN', 'PAL', 'NTSC']:
-                return tag.upper()
-        return 'U'
-
-    def _region_rank(self, regions): return sum(self._build_rank_table(self.regions).get(r, 999) for r in regions)  # Calculate region priority
-
-    def _get_disc_info(self, tags):  # Extract disc/version info from tags
-        disc_info = {'disc': 1, 'version': 1, 'rev': 1}
-        for tag in tags:
-            if tag.lower().startswith('disc'): disc_info['disc'] = int(tag[4:]) if tag[4:].isdigit() else 1
-            elif tag.lower().startswith('v'): disc_info['version'] = int(tag[1:]) if tag[1:].isdigit() else 1
-            elif tag.lower().startswith('rev'): disc_info['rev'] = int(tag[3:]) if tag[3:].isdigit() else 1
-        return disc_info
-
-    def _build_rank(self, tags):  # Build ranking score for file selection
-        region = self._get_region(tags)
-        disc_info = self._get_disc_info(tags)
-        region_rank = self._region_rank([region])
-        purity_score = self._purity_score(tags, "")
-        return (region_rank, disc_info['disc'], disc_info['version'], disc_info['rev'], -purity_score)
-
-    def _purity_score(self, tags, filename):  # Calculate purity score for ROM quality
-        score = 0
-        for tag in tags:
-            tag_lower = tag.lower()
-            if tag_lower in ['w', 'e', 'u', 'j', 'usa', 'eur', 'jpn', 'pal', 'ntsc']: score += 10
-            elif tag_lower in ['final', 'complete', 'full']: score += 5
-            elif tag_lower in ['demo', 'beta', 'alpha', 'prototype']: score -= 20
-            elif tag_lower in ['hack', 'mod', 'patch']: score -= 10
-        return score
-
-    def clean(self):  # Remove duplicate ROMs with preview
+    def parse(self, filename):  # Parsed filename record, cached per filename
+        name = self.names.get(filename)
+        if name is None: name = self.names[filename] = RomName(filename)
+        return name
+
+    def rank(self, filename): return self.parse(filename).rank(self.rank_table)  # Ranking score for file selection
+
+    def clean(self, content=False, hardlink=False):  # Remove duplicate ROMs with preview
+        if content or hardlink: return self.clean_content(hardlink)
         all_files = []
         for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
-            system = os.path.basename(system_dir)
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append((file_path, system))
+            if not os.path.isdir(system_dir): continue
+            with os.scandir(system_dir) as it:
+                all_files.extend((e.path, e.name) for e in it if not e.name.startswith('.') and e.is_file())
         
         if not all_files: print("No games found."); return
         
         by_title = {}
-        for path, system in all_files:
-            filename = os.path.basename(path)
-            clean_title = self._clean_name(filename)
-            if clean_title not in by_title: by_title[clean_title] = []
-            by_title[clean_title].append((path, filename))
+        for path, filename in all_files:
+            by_title.setdefault(self.parse(filename).title, []).append((path, filename))
         
         duplicates = {title: files for title, files in by_title.items() if len(files) > 1}
         if not duplicates: print("No duplicate games found."); return
         
-        to_keep, to_delete = [], []
+        to_keep, to_delete = set(), []
         for title, files in duplicates.items():
-            ranked_files = []
-            for path, filename in files:
-                tags = self._extract_tags(filename)
-                rank = self._build_rank(tags)
-                ranked_files.append((rank, path, filename))
-            ranked_files.sort()
-            to_keep.append((ranked_files[0][1], title))
-            to_delete.extend([(path, title) for _, path, _ in ranked_files[1:]])
+            ranked_files = sorted((self.rank(filename), path) for path, filename in files)
+            to_keep.add((ranked_files[0][1], title))
+            to_delete.extend([(path, title) for _, path in ranked_files[1:]])
         
         if not to_delete: print("No duplicate games found."); return
         
         print(f"The following duplicate games will be processed:")
         
         current_title = None
-        for path, title in sorted(to_keep + to_delete, key=lambda x: (x[1], x[0])):
+        for path, title in sorted([*to_keep, *to_delete], key=lambda x: (x[1], x[0])):
             if title != current_title:
                 if current_title is not None: print()
                 print(f"\033[1m{title}:\033[0m")
@@ -641,26 +2123,266 @@ class RomCleaner:  # Duplicate ROM detection and removal
             print(f"\033[92m✓ {len(to_delete)}\033[0m duplicates removed")
         else: print("Abort.")
 
+    def clean_content(self, hardlink=False):  # Remove or hardlink byte-identical ROMs across all systems
+        from concurrent.futures import ThreadPoolExecutor
+        from tqdm import tqdm
+        by_size = {}
+        for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
+            if not os.path.isdir(system_dir): continue
+            system = os.path.basename(system_dir)
+            with os.scandir(system_dir) as it:
+                for e in it:
+                    if e.name.startswith('.') or not e.is_file(follow_symlinks=False): continue
+                    st = e.stat()
+                    if st.st_size: by_size.setdefault(st.st_size, []).append((e.path, system, st))
+        
+        # Only files sharing a size can be identical, so everything else is never hashed
+        candidates = [c for group in by_size.values() if len(group) > 1 for c in group]
+        if not candidates: print("No duplicate games found."); return
+        
+        hashdb = HashDB()
+        try:
+            known = hashdb.cached([(path, st.st_size, st.st_mtime_ns) for path, _, st in candidates])
+            todo = [c for c in candidates if c[0] not in known]
+            if todo:
+                with tqdm(total=len(todo), desc="Hashing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
+                    with ThreadPoolExecutor(max_workers=self.settings["hash_workers"]) as exe:
+                        for (path, _, _), sha1 in zip(todo, exe.map(lambda c: file_sha1(c[0]), todo)):
+                            if sha1: known[path] = sha1
+                            pbar.update(1)
+                hashdb.store_hashes([(path, system, st.st_size, st.st_mtime_ns, known[path]) for path, system, st in todo if path in known])
+        finally: hashdb.close()
+        
+        groups = {}
+        for path, system, st in candidates:
+            if path in known: groups.setdefault((st.st_size, known[path]), []).append((path, st))
+        
+        to_keep, to_dup = [], []
+        for files in groups.values():
+            if len(files) < 2: continue
+            ranked = sorted(files, key=lambda x: (self.rank(os.path.basename(x[0])), x[0]))
+            keep_path, keep_st = ranked[0]
+            dups = [path for path, st in ranked[1:] if (st.st_dev, st.st_ino) != (keep_st.st_dev, keep_st.st_ino)]  # Skip existing hardlinks
+            if dups: to_keep.append(keep_path); to_dup.extend((path, keep_path) for path in dups)
+        
+        if not to_dup: print("No duplicate games found."); return
+        
+        print(f"The following identical games will be {'hardlinked' if hardlink else 'removed'}:")
+        for i, keep_path in enumerate(sorted(to_keep)):
+            if i: print()
+            print(f"\033[1m{os.path.basename(keep_path)}:\033[0m")
+            for path in [keep_path] + sorted(p for p, k in to_dup if k == keep_path):
+                system_colored = f"\033[36m[{os.path.basename(os.path.dirname(path))}]\033[0m"
+                size_colored = f"\033[33m({format_size(os.path.getsize(path))})\033[0m"
+                print(f"  {system_colored} {size_colored} {os.path.basename(path)}")
+                if path == keep_path: print(f"    \033[92m→ Keep:\033[0m Best version")
+                elif hardlink: print(f"    \033[33m→ Link:\033[0m Identical content")
+                else: print(f"    \033[91m→ Delete:\033[0m Identical content")
+        
+        confirm = input("Do you want to continue? [Y/n] ")
+        if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
+        done, freed, failed = 0, 0, 0
+        for path, keep_path in to_dup:
+            size = os.path.getsize(path)
+            try:
+                if hardlink:
+                    os.link(keep_path, path + ".link"); os.replace(path + ".link", path)
+                else: os.remove(path)
+                done += 1; freed += size
+            except OSError as e:
+                failed += 1; print(f"E: {os.path.basename(path)}: {e}")
+        print(f"\033[92m✓ {done}\033[0m duplicates {'hardlinked' if hardlink else 'removed'}, {format_size(freed)} freed" + (f", \033[91m✗ {failed}\033[0m failed" if failed else ""))
+
+def daemon_socket():  # Path of the daemon's Unix socket
+    return load_settings()["daemon_socket"] or os.path.join(get_config_dir(), "daemon.sock")
+
+def daemon_call(argv, path=None):  # Run a command in a running daemon and print its output; None when no daemon answers
+    import sys, socket
+    path = path or daemon_socket()
+    if not os.path.exists(path): return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(60)
+            s.connect(path)
+            s.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+            reply = json.loads(s.makefile("rb").readline())
+    except (OSError, ValueError): return None  # Stale socket or daemon gone: run in-process
+    sys.stdout.write(reply["output"]); sys.stdout.flush()
+    return reply["status"]
+
+class Watcher:  # inotify through libc; fd is None where it is unavailable and callers poll instead
+    MASK = 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800  # CLOSE_WRITE, MOVED_FROM/TO, CREATE, DELETE, DELETE_SELF, MOVE_SELF
+    OVERFLOW, IGNORED, CLOSE_WRITE = 0x4000, 0x8000, 0x8
+
+    def __init__(self):
+        self.fd, self.wds = None, {}
+        try:
+            import ctypes
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0: self.fd = fd
+        except (OSError, AttributeError): pass
+
+    def watch(self, path, key):  # Report changes in a directory under key; False if it cannot be watched
+        if self.fd is None: return False
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd >= 0: self.wds[wd] = key
+        return wd >= 0
+
+    def read(self):  # Yield (key, name, mask) for pending events; key is None for a queue overflow
+        try: data = os.read(self.fd, 65536)
+        except BlockingIOError: return
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = struct.unpack_from("iIII", data, pos)
+            name = data[pos + 16:pos + 16 + size].rstrip(b"\0").decode(errors="surrogateescape")
+            pos += 16 + size
+            if mask & self.OVERFLOW: yield None, "", mask
+            elif mask & self.IGNORED:  # Watch removed along with its directory
+                if wd in self.wds: yield self.wds.pop(wd), name, mask
+            elif wd in self.wds: yield self.wds[wd], name, mask
+
+    def close(self):
+        if self.fd is not None: os.close(self.fd); self.fd = None
+
+class Daemon:  # Resident process answering search and list from an in-memory catalog and installed index
+    def __init__(self, path=None):
+        self.path = path or daemon_socket()
+        self.watcher = Watcher()
+        self.reset()
+
+    def stamp(self):  # Identity of the files the daemon holds, to notice replacements
+        out = []
+        for path in (os.path.join(self.mgr.config_dir, "settings.json"), self.mgr.cfg, self.mgr.catalog.path):
+            try: st = os.stat(path); out.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except OSError: out.append(None)
+        return out
+
+    def reset(self):  # (Re)load settings, systems and catalog and watch the directories they live in
+        old = getattr(self, "mgr", None)
+        self.mgr = Manager()
+        self.mgr.load()
+        if self.mgr.catalog.exists(): self.mgr.catalog.hold()
+        if old and old.catalog.held: old.catalog.held.close()
+        self.stamps, self.dirty, self.rewritten = self.stamp(), False, set()
+        self.watcher.watch(self.mgr.config_dir, "")
+        self.watch_roms()
+
+    def watch_roms(self):  # Watch the roms dir and its system directories once it exists
+        roms_dir = self.mgr.settings["roms_dir"]
+        self.roms_watched = os.path.isdir(roms_dir) and self.watcher.watch(roms_dir, os.sep)
+        if self.roms_watched:  # System directories are only trusted while their parent is watched too
+            for e in os.scandir(roms_dir):
+                if e.is_dir() and self.watcher.watch(e.path, e.name): self.mgr.installed.watched.add(e.name)
+
+    def changed(self):  # Apply pending inotify events
+        for key, name, mask in self.watcher.read():
+            if key is None: self.mgr.installed.forget(); self.dirty = True  # Events were lost: check everything
+            elif key == "": self.dirty = True  # Config dir: settings, systems or catalog may have been replaced
+            elif key == os.sep:  # Roms dir: a system directory appeared or went away
+                if mask & Watcher.IGNORED: self.mgr.installed.forget(); self.mgr.installed.watched.clear(); self.roms_watched = False; continue
+                self.mgr.installed.forget(name)
+                path = os.path.join(self.mgr.settings["roms_dir"], name)
+                if os.path.isdir(path) and self.watcher.watch(path, name): self.mgr.installed.watched.add(name)
+            else:
+                self.mgr.installed.forget(key)
+                if mask & Watcher.CLOSE_WRITE and name: self.rewritten.add((key, name))  # Size may change without a directory mtime change
+                if mask & Watcher.IGNORED: self.mgr.installed.watched.discard(key)
+
+    def run(self, argv):  # Run one command with its output captured; returns (status, output)
+        from contextlib import redirect_stdout
+        if self.watcher.fd is not None:
+            self.changed()  # Events queued before this request arrived
+            if not self.roms_watched: self.watch_roms()
+        if self.watcher.fd is None or self.dirty:  # Without inotify, poll the held files on every request
+            if self.stamp() != self.stamps: self.reset()
+            self.dirty = False
+        if self.rewritten:
+            manifest = Manifest(self.mgr.settings["roms_dir"])
+            try: manifest.refresh(self.rewritten)
+            finally: manifest.close()
+            self.rewritten = set()
+        out, status = io.StringIO(), 0
+        with redirect_stdout(out), span("daemon", " ".join(argv)):
+            cmd = argv[0] if argv else ""
+            if cmd == "ping": pass
+            elif cmd == "stop": self.running = False
+            elif cmd == "list":
+                if not self.mgr.systems: print("E: Could not load systems.json"); status = 1
+                else: self.mgr.list()
+            elif cmd == "search":
+                if len(argv) < 2: print("E: No search term specified"); status = 1
+                elif not self.mgr.systems: print("E: Could not load systems.json"); status = 1
+                elif not self.mgr.catalog.held: print("E: No package data found. Run 'retro update' first."); status = 1
+                else: self.mgr.search(argv[1:])
+            else: print(f"E: Invalid operation {cmd}"); status = 1
+        return status, out.getvalue()
+
+    def handle(self, conn):  # Answer one JSON-line request on a client connection
+        with conn:
+            try:
+                conn.settimeout(5)
+                req = json.loads(conn.makefile("rb").readline())
+                try: status, output = self.run([str(a) for a in req["argv"]])
+                except Exception as e: status, output = 1, f"E: {e}\n"
+                conn.sendall(json.dumps({"status": status, "output": output}).encode() + b"\n")
+            except (OSError, ValueError, KeyError, TypeError): pass
+
+    def serve(self):  # Listen on the socket until stopped or terminated
+        import sys, signal, socket, selectors
+        if daemon_call(["ping"], self.path) is not None: print(f"E: A daemon is already listening on {self.path}"); return False
+        if os.path.exists(self.path): os.remove(self.path)  # Stale socket from a daemon that did not exit cleanly
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # Socket is private to the user
+        try: server.bind(self.path)
+        finally: os.umask(old_umask)
+        server.listen(64)
+        sel = selectors.DefaultSelector()
+        sel.register(server, selectors.EVENT_READ)
+        if self.watcher.fd is not None: sel.register(self.watcher.fd, selectors.EVENT_READ)
+        signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+        print(f"Listening on {self.path} ({'inotify' if self.watcher.fd is not None else 'polling'})")
+        self.running = True
+        try:
+            while self.running:
+                for key, events in sel.select():
+                    if key.fileobj is server: self.handle(server.accept()[0])
+                    else: self.changed()
+        except KeyboardInterrupt: pass
+        finally:
+            sel.close(); server.close(); self.watcher.close()
+            if os.path.exists(self.path): os.remove(self.path)
+        return True
+
 def main():  # Main CLI entry point
     import sys
 
+    if "--metrics" in sys.argv:
+        sys.argv.remove("--metrics")
+        enable_metrics()
+
     if len(sys.argv) < 2:
         print("retro - retro game package manager")
         print("Usage: retro <command> [options]\n")
         print("Commands:")
-        print("  update      - Update game lists")
+        print("  update      - Update game lists (--full to ignore cache, --changes to list what changed)")
         print("  install     - Install games")
         print("  remove      - Remove games")
+        print("  upgrade     - Reinstall games whose catalog entry changed")
         print("  list        - List installed games")
         print("  search      - Search available games")
         print("  compress    - Compress ROMs to CHD")
-        print("  autoremove  - Remove duplicates\n")
+        print("  autoremove  - Remove duplicates (--content to match by hash, --hardlink to link instead of delete)")
+        print("  daemon      - Serve search and list from memory over a Unix socket (stop to shut it down)")
+        print("  bench       - Benchmark commands against a local mirror stand-in\n")
+        print("Options:")
+        print("  --metrics   - Write stage timings to ~/.config/retro/metrics\n")
         sys.exit(0)
 
     cmd = sys.argv[1]
 
     if cmd == "update":
-        Manager().update()
+        Manager().update(full="--full" in sys.argv[2:], changes="--changes" in sys.argv[2:])
 
     elif cmd == "install":
         if len(sys.argv) < 3:
@@ -672,16 +2394,10 @@ def main():  # Main CLI entry point
             print("E: Could not load systems.json")
             sys.exit(1)
 
-        if not os.path.exists(os.path.join(mgr.config_dir, "packages.json")):
+        if not mgr.catalog.exists():
             print("E: No package data found. Run 'retro update' first.")
             sys.exit(1)
 
-        try:
-            mgr.files = json.load(open(os.path.join(mgr.config_dir, "packages.json")))
-        except Exception as e:
-            print(f"E: Could not load packages.json: {e}")
-            sys.exit(1)
-
         query = " ".join(sys.argv[2:])
         original_input = input
         input_func = lambda prompt: query if "Keywords" in prompt else ""
@@ -716,7 +2432,13 @@ def main():  # Main CLI entry point
         mgr.uninstall()
         builtins.input = original_input
     
+    elif cmd == "upgrade":
+        Manager().upgrade()
+
     elif cmd == "list":
+        status = None if get_metrics() else daemon_call(sys.argv[1:])  # Stage metrics are recorded in-process
+        if status is not None: sys.exit(status)
+
         mgr = Manager()
         if not mgr.load():
             print("E: Could not load systems.json")
@@ -728,21 +2450,18 @@ def main():  # Main CLI entry point
             print("E: No search term specified")
             sys.exit(1)
 
+        status = None if get_metrics() else daemon_call(sys.argv[1:])
+        if status is not None: sys.exit(status)
+
         mgr = Manager()
         if not mgr.load():
             print("E: Could not load systems.json")
             sys.exit(1)
 
-        if not os.path.exists(os.path.join(mgr.config_dir, "packages.json")):
+        if not mgr.catalog.exists():
             print("E: No package data found. Run 'retro update' first.")
             sys.exit(1)
 
-        try:
-            mgr.files = json.load(open(os.path.join(mgr.config_dir, "packages.json")))
-        except Exception as e:
-            print(f"E: Could not load packages.json: {e}")
-            sys.exit(1)
-
         query_terms = sys.argv[2:]
         mgr.search(query_terms)
 
@@ -750,7 +2469,16 @@ def main():  # Main CLI entry point
         Converter().auto_compress_all()
 
     elif cmd == "autoremove":
-        RomCleaner("W,E,U,J").clean()
+        RomCleaner("W,E,U,J").clean(content="--content" in sys.argv[2:], hardlink="--hardlink" in sys.argv[2:])
+
+    elif cmd == "daemon":
+        if sys.argv[2:] == ["stop"]:
+            if daemon_call(["stop"]) is None: print("E: No daemon is running"); sys.exit(1)
+        elif not Daemon().serve(): sys.exit(1)
+
+    elif cmd == "bench":
+        from .bench import bench
+        bench(sys.argv[2:])
 
     else:
         print(f"E: Invalid operation {cmd}")
@@ -28,7 +28,6 @@ setup(
     install_requires=[
         "requests",
         "tqdm",
-        "beautifulsoup4",
         "py7zr",
         "rarfile",
     ],
@@ -0,0 +1,52 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["requests", "tqdm", "py7zr", "rarfile", "asyncio", "concurrent.futures"]
+BUDGET_MS = 100  # Cumulative import time of the retro package; was ~195 ms with eager imports
+
+CHILD = """
+import json, sys
+from retro.main import main
+heavy = %r
+loaded = lambda: sorted(m for m in heavy if m in sys.modules)
+after_import = loaded()
+sys.argv = ["retro"] + sys.argv[1:]
+try: main()
+except SystemExit: pass
+print(json.dumps({"import": after_import, "dispatch": loaded()}))
+""" % HEAVY
+
+def run(home, *args, flags=()):  # Run python in a scratch HOME with the repo on the path
+    env = {**os.environ, "HOME": str(home), "PYTHONPATH": ROOT}
+    return subprocess.run([sys.executable, *flags, *args], cwd=str(home), env=env, capture_output=True, text=True, check=True)
+
+def scratch_home(tmp_path):  # One system with a cataloged package and an installed ROM, so list and search run to completion offline
+    cfg, roms = tmp_path / ".config" / "retro", tmp_path / "roms" / "gb"
+    cfg.mkdir(parents=True)
+    roms.mkdir(parents=True)
+    (roms / "Mario (USA).gb").write_bytes(b"\0" * 1024)
+    (cfg / "systems.json").write_text(json.dumps({"gb": {"name": "Game Boy", "format": ["gb"], "url": []}}))
+    (cfg / "settings.json").write_text(json.dumps({"roms_dir": str(tmp_path / "roms")}))
+    record = {"name": "Mario (USA).gb", "link": "Mario%20(USA).gb", "size_str": "1.0 KiB", "size_bytes": 1024, "base": "http://example.invalid/", "system": "gb"}
+    run(tmp_path, "-c", "from retro.main import Catalog; Catalog().write([%r])" % record)
+    return tmp_path
+
+def test_list_and_search_skip_heavy_imports(tmp_path):
+    home = scratch_home(tmp_path)
+    for argv in (["list"], ["search", "mario"]):
+        lines = run(home, "-c", CHILD, *argv).stdout.strip().splitlines()
+        assert any("Mario (USA)" in l for l in lines[:-1]), lines
+        out = json.loads(lines[-1])
+        assert out["import"] == [], out
+        assert out["dispatch"] == [], (argv, out)
+
+def test_import_time_budget(tmp_path):
+    home = scratch_home(tmp_path)
+    err = run(home, "-c", "import retro.main", flags=("-X", "importtime")).stderr
+    us = [int(m.group(1)) for m in re.finditer(r"import time:\s+\d+ \|\s+(\d+) \| retro\.main$", err, re.M)]
+    assert us, err
+    assert us[0] / 1000 < BUDGET_MS, f"import retro took {us[0] / 1000:.1f} ms (budget {BUDGET_MS} ms)"
@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+import tarfile
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retro.main import extract_tar_stream, extract_zip_stream
+
+CUE, BIN = b'FILE "Game.bin" BINARY\n', os.urandom(256 * 1024)  # Random data keeps the compressed stream long enough to cut mid-member
+
+class Unseekable(io.RawIOBase):  # Write-only sink, so zipfile emits data descriptors like streaming producers do
+    def __init__(self): self.data = b""
+    def writable(self): return True
+    def write(self, b): self.data += bytes(b); return len(b)
+
+def zip_stream():
+    sink = Unseekable()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in (("Game.cue", CUE), ("Game.bin", BIN)):
+            with z.open(name, "w") as f: f.write(data)
+    return sink.data
+
+def tar_stream():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:xz", preset=0) as t:
+        for name, data in (("Game.cue", CUE), ("Game.bin", BIN)):
+            info = tarfile.TarInfo(name); info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+CASES = [(extract_zip_stream, zip_stream), (extract_tar_stream, tar_stream)]
+
+def installed(tmp_path):  # System directory holding an older version of the game
+    dst = tmp_path / "psx"
+    dst.mkdir()
+    (dst / "Game.cue").write_bytes(b"old cue")
+    (dst / "Old.bin").write_bytes(b"old bin")
+    return dst
+
+@pytest.mark.parametrize("extract, build", CASES)
+def test_truncated_stream_keeps_existing_files(tmp_path, extract, build):
+    dst, data = installed(tmp_path), build()
+    with pytest.raises(Exception):
+        extract(io.BytesIO(data[:len(data) * 3 // 4]), str(dst))  # Ends inside the second member
+    assert sorted(os.listdir(dst)) == ["Game.cue", "Old.bin"]
+    assert (dst / "Game.cue").read_bytes() == b"old cue"
+
+@pytest.mark.parametrize("extract, build", CASES)
+def test_complete_stream_replaces_files(tmp_path, extract, build):
+    dst = installed(tmp_path)
+    files = extract(io.BytesIO(build()), str(dst), verify=True)
+    assert sorted(os.path.basename(p) for p in files) == ["Game.bin", "Game.cue"]
+    assert sorted(os.listdir(dst)) == ["Game.bin", "Game.cue", "Old.bin"]
+    assert (dst / "Game.cue").read_bytes() == CUE and (dst / "Game.bin").read_bytes() == BIN
+    assert files[str(dst / "Game.bin")]["size"] == len(BIN)